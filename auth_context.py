@@ -0,0 +1,98 @@
+import os
+from typing import Optional, NamedTuple, Dict
+
+from dotenv import load_dotenv
+from sqlalchemy import or_
+from sqlalchemy.orm import Session as DBSession
+
+from db_models import UserOrg, Team, UserTeam
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+AUTH_CONTEXT_CACHE_SIZE = int(os.environ.get("AUTH_CONTEXT_CACHE_SIZE", "10000"))
+AUTH_CONTEXT_TTL_SECONDS = float(os.environ.get("AUTH_CONTEXT_TTL_SECONDS", "5"))
+
+
+class TeamAccess(NamedTuple):
+    org_id: str
+    is_member: bool
+    is_admin: bool
+    is_owner: bool
+
+
+class AuthContext:
+    def __init__(self, user_id: str, org_ids: frozenset, teams: Dict[str, TeamAccess]):
+        self.user_id = user_id
+        self.org_ids = org_ids
+        self.teams = teams
+
+    def is_org_member(self, org_id: str) -> bool:
+        return org_id in self.org_ids
+
+    def is_team_member(self, team_id: str) -> bool:
+        team = self.teams.get(team_id)
+        return team is not None and team.is_member
+
+    def is_team_owner(self, team_id: str) -> bool:
+        team = self.teams.get(team_id)
+        return team is not None and team.is_owner
+
+    def can_edit_team(self, team_id: str, org_id: Optional[str] = None) -> bool:
+        team = self.teams.get(team_id)
+        if team is None or (org_id is not None and team.org_id != org_id):
+            return False
+        return team.is_owner or team.is_admin
+
+    def team_role(self, team_id: str) -> str:
+        team = self.teams.get(team_id)
+        if team is None:
+            return "guest"
+        if team.is_owner:
+            return "owner"
+        if team.is_admin:
+            return "admin"
+        return "member" if team.is_member else "guest"
+
+    def editable_team_ids(self, org_id: str) -> set:
+        return {team_id for team_id in self.teams if self.can_edit_team(team_id, org_id)}
+
+
+def load_auth_context(db: DBSession, user_id: str) -> AuthContext:
+    org_ids = frozenset(org_id for org_id, in db.query(UserOrg.org_id).filter(UserOrg.user_id == user_id))
+    rows = db.query(Team.id, Team.org_id, Team.owner_id, UserTeam.user_id, UserTeam.is_admin) \
+        .outerjoin(UserTeam, (UserTeam.team_id == Team.id) & (UserTeam.user_id == user_id)) \
+        .filter(or_(UserTeam.user_id == user_id, Team.owner_id == user_id)) \
+        .all()
+    teams = {
+        team_id: TeamAccess(org_id=org_id, is_member=member_id is not None, is_admin=bool(is_admin),
+                            is_owner=owner_id == user_id)
+        for team_id, org_id, owner_id, member_id, is_admin in rows
+    }
+    return AuthContext(user_id, org_ids, teams)
+
+
+auth_context_cache = TTLCache(AUTH_CONTEXT_CACHE_SIZE, AUTH_CONTEXT_TTL_SECONDS)
+
+
+def get_auth_context(db: DBSession, user_id: str) -> AuthContext:
+    # db sessions live for one request, so db.info holds the contexts resolved during that request
+    request_contexts = db.info.setdefault("auth_contexts", {})
+    auth_context = request_contexts.get(user_id)
+    if auth_context is None:
+        auth_context = auth_context_cache.get(user_id)
+        if auth_context is None:
+            auth_context = load_auth_context(db, user_id)
+            auth_context_cache.put(user_id, auth_context)
+        request_contexts[user_id] = auth_context
+    return auth_context
+
+
+def invalidate_auth_context(db: DBSession, user_id: Optional[str] = None) -> None:
+    request_contexts = db.info.setdefault("auth_contexts", {})
+    if user_id is None:
+        request_contexts.clear()
+        auth_context_cache.clear()
+    else:
+        request_contexts.pop(user_id, None)
+        auth_context_cache.invalidate(user_id)
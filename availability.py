@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+# index of the counter a priority increments while a member's event is running
+PRIORITY_COUNTERS = {"certain": 0, "uncertain": 1, "notime": 2}
+
+
+class AvailabilityWindow(NamedTuple):
+    start: datetime
+    end: datetime
+    certain: int
+    possible: int
+
+    @property
+    def duration(self) -> timedelta:
+        return self.end - self.start
+
+
+def member_state(counters: List[int]) -> Optional[int]:
+    # "notime" wins over overlapping events, "standard" events carry no availability
+    if counters[2]:
+        return None
+    if counters[0]:
+        return 0
+    if counters[1]:
+        return 1
+    return None
+
+
+def compute_availability(events: Iterable[Tuple[str, datetime, datetime, str]], start: datetime,
+                         end: datetime) -> List[AvailabilityWindow]:
+    # sweep line over the event boundaries: sorting is O(E log E), every boundary is applied in O(1)
+    boundaries = []
+    for member_id, event_start, event_end, priority in events:
+        counter = PRIORITY_COUNTERS.get(priority)
+        if counter is None:
+            continue
+        event_start, event_end = max(event_start, start), min(event_end, end)
+        if event_start < event_end:
+            boundaries.append((event_start, 1, member_id, counter))
+            boundaries.append((event_end, -1, member_id, counter))
+    boundaries.sort(key=lambda boundary: boundary[0])
+
+    member_counters = {}
+    totals = [0, 0]
+    windows = []
+    index, previous_time = 0, None
+    while index < len(boundaries):
+        time = boundaries[index][0]
+        if previous_time is not None and (totals[0] or totals[1]):
+            if windows and windows[-1].end == previous_time and \
+                    (windows[-1].certain, windows[-1].possible) == (totals[0], totals[1]):
+                windows[-1] = windows[-1]._replace(end=time)
+            else:
+                windows.append(AvailabilityWindow(previous_time, time, totals[0], totals[1]))
+
+        # all boundaries at the same time are applied before the next window starts
+        while index < len(boundaries) and boundaries[index][0] == time:
+            _, change, member_id, counter = boundaries[index]
+            counters = member_counters.setdefault(member_id, [0, 0, 0])
+            old_state = member_state(counters)
+            counters[counter] += change
+            new_state = member_state(counters)
+            if old_state != new_state:
+                if old_state is not None:
+                    totals[old_state] -= 1
+                if new_state is not None:
+                    totals[new_state] += 1
+            index += 1
+        previous_time = time
+
+    return windows
+
+
+def rank_windows(windows: List[AvailabilityWindow], min_duration: timedelta, limit: int) -> List[AvailabilityWindow]:
+    # most members certainly available first, then most members available at all, then the longest window
+    candidates = [window for window in windows if window.duration >= min_duration]
+    candidates.sort(key=lambda window: (-window.certain, -(window.certain + window.possible), -window.duration,
+                                        window.start))
+    return candidates[:limit]
@@ -0,0 +1,53 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from availability import compute_availability, rank_windows
+
+PRIORITIES = ["certain", "certain", "uncertain", "notime", "standard"]
+
+
+def generate_team_events(member_count: int, events_per_member: int, start: datetime, days: int,
+                         rng: random.Random) -> list:
+    # members enter evening slots of one to four hours, snapped to half hours like in the calendar
+    events = []
+    for member_index in range(member_count):
+        member_id = f"member{member_index}"
+        for _ in range(events_per_member):
+            event_start = start + timedelta(days=rng.randrange(days), hours=rng.randrange(14, 22),
+                                            minutes=30 * rng.randrange(2))
+            event_end = event_start + timedelta(minutes=30 * rng.randrange(2, 9))
+            events.append((member_id, event_start, event_end, rng.choice(PRIORITIES)))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the availability engine on synthetic teams.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 10, 25, 50, 100, 200])
+    parser.add_argument("--events-per-member", type=int, default=20)
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    start = datetime(2024, 1, 1)
+    end = start + timedelta(days=args.days)
+
+    print(f"{'members':>8} {'events':>8} {'windows':>8} {'best ms':>9} {'us/event':>9}")
+    for member_count in args.sizes:
+        events = generate_team_events(member_count, args.events_per_member, start, args.days, rng)
+        timings = []
+        for _ in range(args.repeat):
+            timer_start = time.perf_counter()
+            windows = compute_availability(events, start, end)
+            rank_windows(windows, timedelta(hours=1), 10)
+            timings.append(time.perf_counter() - timer_start)
+        best = min(timings)
+        print(f"{member_count:>8} {len(events):>8} {len(windows):>8} {best * 1000:>9.2f} "
+              f"{best / len(events) * 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
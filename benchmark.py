@@ -0,0 +1,379 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+PRIORITY_IDS = ["1", "2", "3", "4", "4"]
+RECURRENCE_RULES = ["FREQ=WEEKLY", "FREQ=WEEKLY;BYDAY=MO,TH", "FREQ=DAILY;INTERVAL=2;COUNT=30"]
+INSERT_BATCH_SIZE = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed a database with synthetic organizations and time the main "
+                                                 "DBHandler methods and routes.")
+    parser.add_argument("--database-url", help="empty database to seed, e.g. postgresql+psycopg://bench:bench@"
+                                               "localhost:5432/bench from a container, a temporary SQLite file "
+                                               "is used by default")
+    parser.add_argument("--orgs", type=int, default=1)
+    parser.add_argument("--teams", type=int, default=5, help="teams per organization")
+    parser.add_argument("--members", type=int, default=10, help="members per team")
+    parser.add_argument("--events-per-member", type=int, default=200, help="spread over the whole history")
+    parser.add_argument("--events-per-team", type=int, default=50)
+    parser.add_argument("--years", type=float, default=2, help="years of history before today")
+    parser.add_argument("--recurring-share", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=10, help="clients of the request overlap check")
+    parser.add_argument("--concurrent-requests", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_report.json", help="machine-readable report")
+    parser.add_argument("--compare", help="earlier report to compare the median wall times with")
+    return parser.parse_args()
+
+
+def random_event(rng: random.Random, history_start: datetime, history_days: int, recurring_share: float) -> dict:
+    # evening slots snapped to half hours, like the ones entered in the calendar
+    start_point = history_start + timedelta(days=rng.randrange(history_days), hours=rng.randrange(14, 22),
+                                            minutes=30 * rng.randrange(2))
+    end_point = start_point + timedelta(minutes=30 * rng.randrange(2, 9))
+    return {
+        "title": "",
+        "memo": "",
+        "start_point": start_point,
+        "end_point": end_point,
+        "priority_id": rng.choice(PRIORITY_IDS),
+        "version": 1,
+        "recurrence": rng.choice(RECURRENCE_RULES) if rng.random() < recurring_share else None,
+    }
+
+
+def seed_database(db, args, rng: random.Random) -> dict:
+    # rows go in through bulk inserts, the handler methods under test are not used to build the data set
+    from db_models import User, Org, UserOrg, Team, UserTeam, Event, UserEvent, TeamEvent
+    from recurrence import recurrence_end
+    from utils import generate_id
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    history_days = max(1, int(args.years * 365))
+    # a month of future events, the calendar is mostly looked at around today
+    history_start = now - timedelta(days=history_days - 30)
+    rows = {table: [] for table in (User, Org, UserOrg, Team, UserTeam, Event, UserEvent, TeamEvent)}
+
+    def add_events(link_table, link_column: str, link_id: str, count: int):
+        for _ in range(count):
+            event = dict(random_event(rng, history_start, history_days, args.recurring_share), id=generate_id())
+            event["recurrence_end"] = recurrence_end(event["start_point"], event["end_point"], event["recurrence"])
+            rows[Event].append(event)
+            rows[link_table].append({link_column: link_id, "event_id": event["id"]})
+
+    orgs = []
+    for org_index in range(args.orgs):
+        org_id = generate_id()
+        member_ids = []
+        for team_index in range(args.teams):
+            team_id = generate_id()
+            team_member_ids = [generate_id() for _ in range(args.members)]
+            for user_id in team_member_ids:
+                rows[User].append({"id": user_id, "username": f"bench{org_index}-{len(member_ids)}",
+                                   "password": "", "registration_date": history_start})
+                rows[UserOrg].append({"user_id": user_id, "org_id": org_id, "entry_date_time": history_start})
+                rows[UserTeam].append({"user_id": user_id, "team_id": team_id,
+                                       "is_admin": user_id == team_member_ids[0]})
+                add_events(UserEvent, "user_id", user_id, args.events_per_member)
+                member_ids.append(user_id)
+            rows[Team].append({"id": team_id, "org_id": org_id, "name": f"Team {team_index}",
+                               "owner_id": team_member_ids[0] if team_member_ids else None,
+                               "owner_datetime": history_start})
+            add_events(TeamEvent, "team_id", team_id, args.events_per_team)
+        rows[Org].append({"id": org_id, "name": f"Bench {org_index}", "owner_id": member_ids[0] if member_ids else None,
+                          "owner_datetime": history_start, "revision": 0, "modified_at": now})
+        orgs.append({"org_id": org_id, "user_id": member_ids[0] if member_ids else None})
+
+    # parents before the link tables that reference them
+    for table in (User, Org, UserOrg, Team, UserTeam, Event, UserEvent, TeamEvent):
+        table_rows = rows[table]
+        for index in range(0, len(table_rows), INSERT_BATCH_SIZE):
+            db.bulk_insert_mappings(table, table_rows[index:index + INSERT_BATCH_SIZE])
+    db.commit()
+
+    return {
+        "now": now,
+        "orgs": orgs,
+        "row_counts": {table.__tablename__: len(table_rows) for table, table_rows in rows.items()},
+    }
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def measure(run, repeat: int, query_counter: QueryCounter) -> dict:
+    # wall times come from untraced runs, tracemalloc slows allocations down too much to time them
+    wall_times, queries = [], 0
+    for _ in range(repeat):
+        query_counter.count = 0
+        start = time.perf_counter()
+        run()
+        wall_times.append(time.perf_counter() - start)
+        queries = query_counter.count
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": repeat,
+        "wall_ms": {
+            "min": min(wall_times) * 1000,
+            "median": statistics.median(wall_times) * 1000,
+            "max": max(wall_times) * 1000,
+        },
+        "queries": queries,
+        "peak_memory_kib": peak_memory / 1024,
+    }
+
+
+def build_cases(app_module, dataset: dict) -> list:
+    # (kind, name, run) for the first organization, page caches are cleared so every run renders
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+    from db_session import SessionLocal
+    from fragment_cache import fragment_cache
+
+    db_handler = app_module.db_handler
+    org_id, user_id = dataset["orgs"][0]["org_id"], dataset["orgs"][0]["user_id"]
+    now = dataset["now"]
+    start, end = now - timedelta(days=14), now + timedelta(days=21)
+
+    def with_session(call):
+        def run():
+            db = SessionLocal()
+            try:
+                call(db)
+            finally:
+                db.close()
+        return run
+
+    def load_calendar_post_body() -> dict:
+        db = SessionLocal()
+        try:
+            calendar = db_handler.get_org_calendar_details(user_id, org_id, db, start, end)
+        finally:
+            db.close()
+        member_events = next(member.events for team in calendar.teams for member in team.members
+                             if member.user_id == user_id)
+        return jsonable_encoder({
+            "memberEvents": {"user_id": user_id, "events": member_events},
+            "teamsEvents": [{"team_id": team.team_id, "events": team.events}
+                            for team in calendar.teams if team.is_editable],
+            "start": start, "end": end,
+        })
+
+    def save_own_events(db):
+        events = next(member.events for team in db_handler.get_org_calendar_details(user_id, org_id, db, start,
+                                                                                   end).teams
+                      for member in team.members if member.user_id == user_id)
+        db_handler.update_events_for_user(user_id, events, db, start, end)
+
+    db = SessionLocal()
+    try:
+        token = db_handler.update_session(db, user_id)
+    finally:
+        db.close()
+    client = TestClient(app_module.app, base_url="https://testserver", cookies={"token": token})
+    post_body = load_calendar_post_body()
+    window = {"start": start.isoformat() + "Z", "end": end.isoformat() + "Z"}
+
+    def request(method: str, path: str, **kwargs):
+        def run():
+            fragment_cache.clear()
+            response = client.request(method, path, **kwargs)
+            if response.status_code != 200:
+                raise RuntimeError(f"{method} {path} returned {response.status_code}: {response.text[:200]}")
+        return run
+
+    return [
+        ("handler", "get_org_calendar_details[window]",
+         with_session(lambda db: db_handler.get_org_calendar_details(user_id, org_id, db, start, end))),
+        ("handler", "get_org_calendar_details[history]",
+         with_session(lambda db: db_handler.get_org_calendar_details(user_id, org_id, db))),
+        ("handler", "get_org_calendar_events",
+         with_session(lambda db: db_handler.get_org_calendar_events(user_id, org_id, start, end, db))),
+        ("handler", "get_org_calendar_data",
+         with_session(lambda db: db_handler.get_org_calendar_data(user_id, org_id, db, start, end))),
+        ("handler", "get_organization_details",
+         with_session(lambda db: db_handler.get_organization_details(org_id, db))),
+        ("handler", "update_events_for_user[load+save]", with_session(save_own_events)),
+        ("handler", "get_org_heatmap",
+         with_session(lambda db: db_handler.get_org_heatmap(db, org_id, start, end, timedelta(minutes=30)))),
+        ("route", "GET /org/{org_id}/calendar", request("GET", f"/org/{org_id}/calendar")),
+        ("route", "GET /org/{org_id}/calendar/events",
+         request("GET", f"/org/{org_id}/calendar/events", params=window)),
+        ("route", "GET /org/{org_id}/calendar/data", request("GET", f"/org/{org_id}/calendar/data", params=window)),
+        ("route", "POST /org/{org_id}/calendar", request("POST", f"/org/{org_id}/calendar", json=post_body)),
+        ("route", "GET /org/{org_id}", request("GET", f"/org/{org_id}")),
+    ]
+
+
+def measure_overlap(app_module, dataset: dict, concurrency: int, request_count: int) -> dict:
+    # one shared event loop like a single server worker: handlers that block the loop run one after another and
+    # the summed latency equals the wall time, requests handled concurrently push the ratio above 1
+    from fastapi.testclient import TestClient
+    from db_session import SessionLocal
+
+    org_id, user_id = dataset["orgs"][0]["org_id"], dataset["orgs"][0]["user_id"]
+    now = dataset["now"]
+    start, end = now - timedelta(days=14), now + timedelta(days=21)
+    window = {"start": start.isoformat() + "Z", "end": end.isoformat() + "Z"}
+    db = SessionLocal()
+    try:
+        token = app_module.db_handler.update_session(db, user_id)
+    finally:
+        db.close()
+
+    with TestClient(app_module.app, base_url="https://testserver", cookies={"token": token}) as client:
+        def timed_request(_) -> tuple:
+            start = time.perf_counter()
+            response = client.get(f"/org/{org_id}/calendar/data", params=window)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET /org/{org_id}/calendar/data returned {response.status_code}")
+            return start, time.perf_counter()
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = list(executor.map(timed_request, range(request_count)))
+        wall_time = time.perf_counter() - wall_start
+
+    in_flight, max_in_flight = 0, 0
+    for _, delta in sorted([(start, 1) for start, _ in timings] + [(end, -1) for _, end in timings]):
+        in_flight += delta
+        max_in_flight = max(max_in_flight, in_flight)
+    return {
+        "concurrency": concurrency,
+        "requests": request_count,
+        "wall_ms": wall_time * 1000,
+        "overlap_factor": sum(end - start for start, end in timings) / wall_time,
+        "max_in_flight": max_in_flight,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_comparison(results: list, baseline_path: str):
+    with open(baseline_path) as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    print(f"\ncompared with {baseline_path}")
+    print(f"{'case':<42} {'before ms':>10} {'after ms':>10} {'change':>8} {'queries':>9}")
+    for result in results:
+        before = baseline.get(result["name"])
+        if before is None:
+            continue
+        before_ms, after_ms = before["wall_ms"]["median"], result["wall_ms"]["median"]
+        print(f"{result['name']:<42} {before_ms:>10.2f} {after_ms:>10.2f} "
+              f"{(after_ms / before_ms - 1) * 100 if before_ms else 0:>+7.1f}% "
+              f"{before['queries']:>4}>{result['queries']:<4}")
+
+
+def main():
+    args = parse_args()
+    temporary_database = None
+    if args.database_url is None:
+        temporary_database = tempfile.NamedTemporaryFile(suffix=".sqlite", delete=False)
+        temporary_database.close()
+        args.database_url = f"sqlite:///{temporary_database.name}"
+    # the engine is created when db_session is imported, so the application is imported after choosing the database
+    os.environ["SQLALCHEMY_DATABASE_URL"] = args.database_url
+    os.environ["MAINTENANCE_INTERVAL_MINUTES"] = "0"
+
+    try:
+        app_module = importlib.import_module("main")
+        from sqlalchemy import event
+        from db_models import Org
+        from db_session import SessionLocal, engine
+
+        db = SessionLocal()
+        try:
+            if db.query(Org.id).first() is not None:
+                sys.exit("the benchmark database already contains organizations, use an empty one")
+            seed_start = time.perf_counter()
+            dataset = seed_database(db, args, random.Random(args.seed))
+            seed_seconds = time.perf_counter() - seed_start
+        finally:
+            db.close()
+        print(f"seeded {', '.join(f'{count} {table}' for table, count in dataset['row_counts'].items())} "
+              f"in {seed_seconds:.1f}s")
+
+        query_counter = QueryCounter()
+        event.listen(engine, "before_cursor_execute", query_counter)
+        results = []
+        print(f"{'case':<42} {'median ms':>10} {'min ms':>9} {'queries':>8} {'peak KiB':>10}")
+        for kind, name, run in build_cases(app_module, dataset):
+            result = dict(measure(run, args.repeat, query_counter), kind=kind, name=name)
+            results.append(result)
+            print(f"{name:<42} {result['wall_ms']['median']:>10.2f} {result['wall_ms']['min']:>9.2f} "
+                  f"{result['queries']:>8} {result['peak_memory_kib']:>10.1f}")
+        event.remove(engine, "before_cursor_execute", query_counter)
+
+        overlap = [measure_overlap(app_module, dataset, concurrency, args.concurrent_requests)
+                   for concurrency in sorted({1, args.concurrency})]
+        print(f"\n{'concurrent clients':<42} {'wall ms':>10} {'overlap':>9} {'in flight':>10}")
+        for result in overlap:
+            print(f"{result['concurrency']:<42} {result['wall_ms']:>10.2f} {result['overlap_factor']:>9.2f} "
+                  f"{result['max_in_flight']:>10}")
+        engine.dispose()
+    finally:
+        if temporary_database is not None:
+            os.remove(temporary_database.name)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "database": args.database_url.split(":", 1)[0],
+        "dataset": {
+            "orgs": args.orgs,
+            "teams": args.teams,
+            "members": args.members,
+            "events_per_member": args.events_per_member,
+            "events_per_team": args.events_per_team,
+            "years": args.years,
+            "recurring_share": args.recurring_share,
+            "seed": args.seed,
+            "row_counts": dataset["row_counts"],
+        },
+        "results": results,
+        "overlap": overlap,
+    }
+    with open(args.output, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"report written to {args.output}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
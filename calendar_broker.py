@@ -0,0 +1,106 @@
+import abc
+import asyncio
+import importlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, Iterable, AsyncIterator
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "module:ClassName" of a BrokerBackend, e.g. one that relays through a message bus when running several workers
+CALENDAR_BROKER_BACKEND = os.environ.get("CALENDAR_BROKER_BACKEND", "")
+CALENDAR_STREAM_QUEUE_SIZE = int(os.environ.get("CALENDAR_STREAM_QUEUE_SIZE", "100"))
+CALENDAR_STREAM_KEEPALIVE_SECONDS = float(os.environ.get("CALENDAR_STREAM_KEEPALIVE_SECONDS", "15"))
+
+RESYNC_MESSAGE = json.dumps({"type": "resync"})
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerBackend(abc.ABC):
+    # publish may be called from any thread, callbacks have to be thread-safe
+    @abc.abstractmethod
+    def publish(self, channel: str, message: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> Callable[[], None]:
+        pass
+
+
+class InProcessBackend(BrokerBackend):
+    # only reaches subscribers connected to the same worker process
+    def __init__(self):
+        self.__subscribers = {}
+        self.__lock = threading.Lock()
+
+    def publish(self, channel: str, message: str) -> None:
+        with self.__lock:
+            callbacks = list(self.__subscribers.get(channel, ()))
+        for callback in callbacks:
+            callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]) -> Callable[[], None]:
+        with self.__lock:
+            self.__subscribers.setdefault(channel, set()).add(callback)
+
+        def unsubscribe():
+            with self.__lock:
+                callbacks = self.__subscribers.get(channel)
+                if callbacks is not None:
+                    callbacks.discard(callback)
+                    if not callbacks:
+                        del self.__subscribers[channel]
+
+        return unsubscribe
+
+
+class CalendarBroker:
+    def __init__(self, backend: BrokerBackend, queue_size: int):
+        self.__backend = backend
+        self.__queue_size = queue_size
+
+    def publish(self, org_ids: Iterable[str], message: dict) -> None:
+        # a failing backend must not fail the request that already committed its changes
+        payload = json.dumps(message, separators=(',', ':'))
+        for org_id in org_ids:
+            try:
+                self.__backend.publish(org_id, payload)
+            except Exception:
+                logger.exception("publishing calendar changes for org %s failed", org_id)
+
+    async def subscribe(self, org_id: str, keepalive_seconds: float) -> AsyncIterator[str]:
+        # yields messages of the organization and None when nothing happened for keepalive_seconds
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.__queue_size)
+
+        def enqueue(message: str):
+            if queue.full():
+                # the subscriber fell behind, it has to reload instead of applying the remaining changes
+                queue.get_nowait()
+                message = RESYNC_MESSAGE
+            queue.put_nowait(message)
+
+        unsubscribe = self.__backend.subscribe(org_id, lambda message: loop.call_soon_threadsafe(enqueue, message))
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            unsubscribe()
+
+
+def load_backend(path: str) -> BrokerBackend:
+    if not path:
+        return InProcessBackend()
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+calendar_broker = CalendarBroker(load_backend(CALENDAR_BROKER_BACKEND), CALENDAR_STREAM_QUEUE_SIZE)
@@ -1,28 +1,96 @@
-from typing import List, Type
+import json
+from itertools import groupby
+from typing import List, Type, Optional, NamedTuple, Iterator, Tuple
+
+import numpy as np
 
 from fastapi import HTTPException
 import sqlalchemy.exc
-from sqlalchemy.orm import Session as DBSession, joinedload
-from sqlalchemy import desc
-from sqlalchemy.sql.expression import null
+from sqlalchemy.orm import Session as DBSession, selectinload
+from sqlalchemy import case, desc, exists, select, or_
 
 from db_session import SessionLocal
 from schemas import RegistrationCredentials, OrganizationSchema, OrganizationsSchema, OrganizationDetailsSchema, \
     MemberSchema, TeamSchema, TeamDetailsSchema, MemberEventsSchema, TeamEventsMembersSchema, EventSchema, \
-    OrgCalendarSchema, TeamDetailsMemberSchema, ChangeTeamRoleSchema
+    OrgCalendarSchema, TeamDetailsMemberSchema, ChangeTeamRoleSchema, \
+    PostCalendarChangesSchema, CalendarChangesResultSchema, PostOrgCalendarSchema, EventChangeSchema, \
+    AvailabilityWindowSchema, TeamAvailabilitySchema
 from db_models import User, Session, Org, UserOrg, Team, UserTeam, Event, UserEvent, TeamEvent, EventPriority, \
     TeamInvite, OrgCode
-import uuid
 from datetime import datetime, timezone, timedelta
-from utils import add_amount_of_days
+from utils import add_amount_of_days, to_naive_utc, generate_id, generate_token, to_epoch_seconds, to_iso_utc
+from session_cache import session_cache, CachedSession, SESSION_REFRESH_THRESHOLD_MINUTES
+from auth_context import get_auth_context, invalidate_auth_context
+from fragment_cache import fragment_cache
+from calendar_broker import calendar_broker
+from availability import compute_availability, rank_windows
+from heatmap import to_slot_indexes, build_heatmap
+from recurrence import normalize_rule, recurrence_end, expand_occurrences, expand_rows, is_occurrence, \
+    MAX_EXPANSION_WINDOW, RECURRENCE_MAX_WINDOW_DAYS
+from request_timing import timed_phase
 from enum import Enum
 
 
+INVITE_VALID_DURATION = timedelta(hours=24)
+ID_ALLOCATION_ATTEMPTS = 3
+# rows fetched per round trip by the server-side cursors of the streamed calendar
+STREAM_YIELD_PER = 1000
+
+
 class EventAllocation(Enum):
     User = 1
     Team = 2
 
 
+class EventRow(NamedTuple):
+    # the read paths work on plain rows, neither ORM objects nor schemas are built per event
+    id: str
+    title: str
+    memo: str
+    start_point: datetime
+    end_point: datetime
+    event_priority: str
+    version: int
+    recurrence: Optional[str]
+
+
+EVENT_ROW_COLUMNS = (Event.id, Event.title, Event.memo, Event.start_point, Event.end_point, EventPriority.name,
+                     Event.version, Event.recurrence)
+# the full save submits every loaded event, a row is only written when one of these differs from the stored one
+CHANGE_TRACKED_EVENT_COLUMNS = ('title', 'memo', 'priority_id', 'recurrence', 'start_point', 'end_point')
+
+
+class RowGroups:
+    # consumes rows ordered by key one group at a time, groups of unexpected keys are skipped,
+    # e.g. a team created after the teams of the streamed calendar were read
+    def __init__(self, rows, key, expected_keys: set):
+        self.__groups = groupby(rows, key)
+        self.__expected_keys = expected_keys
+        self.__current = next(self.__groups, None)
+
+    def take(self, group_key) -> Iterator:
+        while self.__current is not None and self.__current[0] not in self.__expected_keys:
+            self.__current = next(self.__groups, None)
+        if self.__current is not None and self.__current[0] == group_key:
+            yield from self.__current[1]
+            self.__current = next(self.__groups, None)
+
+
+class CalendarMemberRows(NamedTuple):
+    user_id: str
+    username: str
+    is_editable: bool
+    events: List[EventRow]
+
+
+class CalendarTeamRows(NamedTuple):
+    team_id: str
+    team_name: str
+    is_editable: bool
+    events: List[EventRow]
+    members: List[CalendarMemberRows]
+
+
 def get_db() -> DBSession:
     db = None
     try:
@@ -33,40 +101,62 @@ def get_db() -> DBSession:
 
 
 class DBHandler:
-    __event_ids_for_optimization = []
-
-    def __get_unique_uuid(self, db: DBSession, table) -> str:
-        def generate_uuid() -> str:
-            random_uuid = uuid.uuid4()
-            return str(random_uuid).replace("-", "")
-
-        def uuid_not_in_db(uuid_str: str, db: DBSession, query_table) -> bool:
-            return not db.query(query_table).filter_by(id=uuid_str).first()
-
-        while True:
-            tmp_uuid = generate_uuid()
-
-            if uuid_not_in_db(tmp_uuid, db, table):
-                return tmp_uuid
+    def __commit_with_new_ids(self, db: DBSession, add_rows):
+        # ids are generated without probing the tables, uniqueness is left to the primary keys: after a conflict the
+        # whole unit of work is repeated with new ids, a conflict that persists comes from another constraint
+        for attempt in range(ID_ALLOCATION_ATTEMPTS):
+            result = add_rows()
+            try:
+                db.commit()
+                return result
+            except sqlalchemy.exc.IntegrityError:
+                db.rollback()
+                if attempt + 1 == ID_ALLOCATION_ATTEMPTS:
+                    raise
 
-    def __get_team_ids_by_org(self, org_id: str, db: Session) -> List[str]:
-        org = db.query(Org).filter(Org.id == org_id).first()
-        if not org:
+    def __get_teams_by_org(self, org_id: str, db: DBSession) -> List[Team]:
+        if not self.org_exists(db, org_id):
             raise HTTPException(status_code=404, detail='Organization not found.')
 
-        team_ids = [team.id for team in org.teams]
-        return team_ids
+        return db.query(Team) \
+            .options(selectinload(Team.users).joinedload(UserTeam.user)) \
+            .filter(Team.org_id == org_id) \
+            .all()
 
     def __is_owner(self, user_id: str, owner_id: str) -> bool:
         return user_id == owner_id
 
+    def __touch_orgs(self, db: DBSession, org_ids) -> None:
+        # bumps the revision used for ETag/Last-Modified, runs inside the caller's transaction
+        db.query(Org) \
+            .filter(Org.id.in_(org_ids)) \
+            .update({Org.revision: Org.revision + 1, Org.modified_at: datetime.now(timezone.utc).replace(tzinfo=None)},
+                    synchronize_session=False)
+
+    def __touch_orgs_of_user(self, db: DBSession, user_id: str) -> None:
+        self.__touch_orgs(db, select(UserOrg.org_id).where(UserOrg.user_id == user_id))
+
+    def get_org_revision(self, db: DBSession, org_id: str) -> Optional[tuple]:
+        return db.query(Org.revision, Org.modified_at).filter(Org.id == org_id).first()
+
+    def __event_window_filter(self, start: Optional[datetime], end: Optional[datetime]) -> list:
+        conditions = []
+        if start is not None:
+            # a series overlaps the window until its last occurrence has ended
+            conditions.append(or_(Event.end_point > to_naive_utc(start),
+                                  Event.recurrence.isnot(None) & (Event.recurrence_end.is_(None) |
+                                                                  (Event.recurrence_end > to_naive_utc(start)))))
+        if end is not None:
+            conditions.append(Event.start_point < to_naive_utc(end))
+        return conditions
+
+    @timed_phase("auth")
     def is_user_member_of_org(self, db: DBSession, user_id: str, org_id: str) -> bool:
-        user_org = db.query(UserOrg).filter_by(user_id=user_id, org_id=org_id).first()
-        return user_org is not None
+        return get_auth_context(db, user_id).is_org_member(org_id)
 
+    @timed_phase("auth")
     def is_user_member_of_team(self, db: DBSession, user_id: str, team_id: str) -> bool:
-        user_team = db.query(UserTeam).filter_by(user_id=user_id, team_id=team_id).first()
-        return user_team is not None
+        return get_auth_context(db, user_id).is_team_member(team_id)
 
     def org_exists(self, db: DBSession, org_id: str) -> bool:
         org = db.query(Org).filter_by(id=org_id).first()
@@ -88,16 +178,18 @@ class DBHandler:
             raise HTTPException(status_code=404, detail='User not found.')
 
     def create_user(self, credentials: RegistrationCredentials, db: DBSession) -> str:
-        new_user = User(
-            id=self.__get_unique_uuid(db, User),
-            username=credentials.username,
-            password=credentials.password,
-            registration_date=datetime.now(timezone.utc).replace(tzinfo=None)
-        )
-        db.add(new_user)
-        try:
-            db.commit()
+        def add_user() -> str:
+            new_user = User(
+                id=generate_id(),
+                username=credentials.username,
+                password=credentials.password,
+                registration_date=datetime.now(timezone.utc).replace(tzinfo=None)
+            )
+            db.add(new_user)
             return new_user.id
+
+        try:
+            return self.__commit_with_new_ids(db, add_user)
         except sqlalchemy.exc.IntegrityError:
             raise HTTPException(status_code=401, detail='User already exists in survey.')
 
@@ -112,7 +204,9 @@ class DBHandler:
                 db_org_code.org.owner_id = session_user_id
                 db_org_code.org.owner_datetime = datetime.now(timezone.utc).replace(tzinfo=None)
                 try:
+                    self.__touch_orgs(db, [db_org_code.org_id])
                     db.commit()
+                    fragment_cache.invalidate(db_org_code.org_id)
                 except Exception:
                     raise HTTPException(status_code=500, detail='Error overriding the owner of the org.')
         else:
@@ -122,22 +216,22 @@ class DBHandler:
     def create_organization(self, organization_name: str, db: DBSession) -> str:
         current_time = datetime.now(timezone.utc).replace(tzinfo=None)
 
-        new_org = Org(
-            id=self.__get_unique_uuid(db, Org),
-            name=organization_name,
-        )
-        db.add(new_org)
+        def add_org() -> str:
+            new_org = Org(
+                id=generate_id(),
+                name=organization_name,
+                modified_at=current_time,
+            )
+            db.add(new_org)
 
-        # add new org code
-        new_org_code = OrgCode(id=self.__get_unique_uuid(db, OrgCode), create_date_time=current_time, org_id=new_org.id)
-        db.add(new_org_code)
+            # add new org code
+            new_org_code = OrgCode(id=generate_token(), create_date_time=current_time, org_id=new_org.id)
+            db.add(new_org_code)
+            return new_org_code.id
 
         try:
-            db.commit()
-
-            return new_org_code.id
+            return self.__commit_with_new_ids(db, add_org)
         except sqlalchemy.exc.IntegrityError:
-            db.rollback()
             raise HTTPException(status_code=401, detail='Error creating organization.')
 
     def delete_organization(self, token: str, org_id: str, db: DBSession) -> bool:
@@ -154,6 +248,7 @@ class DBHandler:
         try:
             db.delete(org)
             db.commit()
+            fragment_cache.invalidate(org_id)
             return True
         except Exception:
             db.rollback()
@@ -177,7 +272,10 @@ class DBHandler:
             user_org = db.query(UserOrg).filter_by(user_id=user_id, org_id=org_id).first()
             if user_org is not None:
                 db.delete(user_org)
+                self.__touch_orgs(db, [org_id])
                 db.commit()
+                invalidate_auth_context(db, user_id)
+                fragment_cache.invalidate(org_id)
 
             return True
         except Exception:
@@ -187,23 +285,29 @@ class DBHandler:
     def create_team(self, user_id, team_name, org_id: str, db: DBSession) -> str:
         if self.is_user_member_of_org(db, user_id, org_id):
             current_time = datetime.now(timezone.utc).replace(tzinfo=None)
-            new_team = Team(
-                id=self.__get_unique_uuid(db, Team),
-                org_id=org_id,
-                name=team_name,
-                owner_id=user_id,
-                owner_datetime=current_time,
-            )
-            db.add(new_team)
+
+            def add_team() -> str:
+                new_team = Team(
+                    id=generate_id(),
+                    org_id=org_id,
+                    name=team_name,
+                    owner_id=user_id,
+                    owner_datetime=current_time,
+                )
+                db.add(new_team)
+                self.__touch_orgs(db, [org_id])
+                return new_team.id
 
             try:
-                db.commit()
+                team_id = self.__commit_with_new_ids(db, add_team)
 
-                new_user_team = UserTeam(user_id=user_id, team_id=new_team.id, is_admin=True)
+                new_user_team = UserTeam(user_id=user_id, team_id=team_id, is_admin=True)
                 db.add(new_user_team)
                 db.commit()
+                invalidate_auth_context(db, user_id)
+                fragment_cache.invalidate(org_id)
 
-                return new_team.id
+                return team_id
             except sqlalchemy.exc.IntegrityError:
                 db.rollback()
                 raise HTTPException(status_code=500, detail='Error creating team')
@@ -211,30 +315,28 @@ class DBHandler:
             raise HTTPException(status_code=403, detail='User is not eligible to create a team')
 
     def rename_team(self, db: DBSession, org_id, team_id, session_user_id, new_team_name: str) -> bool:
-        session_user_team = db.query(UserTeam).filter_by(user_id=session_user_id, team_id=team_id).first()
         team = db.query(Team).filter_by(id=team_id, org_id=org_id).first()
         if team is None:
             raise HTTPException(status_code=404, detail='Team not found')
-        if not (self.__is_owner(session_user_id, team.owner_id) or (session_user_team is not None and
-                                                                    session_user_team.is_admin)):
+        if not get_auth_context(db, session_user_id).can_edit_team(team_id):
             raise HTTPException(status_code=403, detail='Only the team owner and the admins'
                                                         ' are allowed to rename the team')
         try:
             team.name = new_team_name
+            self.__touch_orgs(db, [org_id])
             db.commit()
         except Exception:
             db.rollback()
             raise HTTPException(status_code=500, detail='Failed to rename team')
+        fragment_cache.invalidate(org_id)
         return True
 
     def remove_member_from_team(self, db: DBSession, org_id, team_id, session_user_id, user_id: str) -> bool:
-        session_user_team = db.query(UserTeam).filter_by(user_id=session_user_id, team_id=team_id).first()
         team = db.query(Team).filter_by(id=team_id, org_id=org_id).first()
         if team is None:
             raise HTTPException(status_code=404, detail='Team not found')
         if not (session_user_id == user_id):
-            if not (self.__is_owner(session_user_id, team.owner_id) or (session_user_team is not None and
-                                                                        session_user_team.is_admin)):
+            if not get_auth_context(db, session_user_id).can_edit_team(team_id):
                 raise HTTPException(status_code=403, detail='Only the team owner and the admins are allowed to remove '
                                                             'members from the team')
         if team.owner_id == user_id:
@@ -246,10 +348,13 @@ class DBHandler:
 
         try:
             db.delete(user_team)
+            self.__touch_orgs(db, [org_id])
             db.commit()
         except Exception:
             db.rollback()
             raise HTTPException(status_code=500, detail='Failed to remove member')
+        invalidate_auth_context(db, user_id)
+        fragment_cache.invalidate(org_id)
         return True
 
     def delete_team(self, db: DBSession, org_id, team_id, session_user_id: str) -> bool:
@@ -266,8 +371,10 @@ class DBHandler:
         if not self.__is_owner(session_user_id, team.owner_id):
             raise HTTPException(status_code=403, detail='Only the team owner can delete the team')
 
+        member_ids = [user_team.user_id for user_team in team.users]
         try:
             db.delete(team)
+            self.__touch_orgs(db, [org_id])
             db.commit()
             db.query(Event).filter(Event.id.in_(event_ids)).delete()
             db.commit()
@@ -275,6 +382,9 @@ class DBHandler:
         except Exception:
             db.rollback()
             raise HTTPException(status_code=500, detail='Failed to delete team')
+        for member_id in member_ids + [session_user_id]:
+            invalidate_auth_context(db, member_id)
+        fragment_cache.invalidate(org_id)
         return True
 
     def add_user_to_team(self, session_user_id, team_id, org_id, user_id: str, db: DBSession) -> bool:
@@ -291,7 +401,10 @@ class DBHandler:
         try:
             new_user_team = UserTeam(user_id=user_id, team_id=team_id, is_admin=False)
             db.add(new_user_team)
+            self.__touch_orgs(db, [org_id])
             db.commit()
+            invalidate_auth_context(db, user_id)
+            fragment_cache.invalidate(org_id)
 
             return True
         except sqlalchemy.exc.IntegrityError:
@@ -315,7 +428,10 @@ class DBHandler:
 
         try:
             db.delete(user_team)
+            self.__touch_orgs(db, [org_id])
             db.commit()
+            invalidate_auth_context(db, user_id)
+            fragment_cache.invalidate(org_id)
             return True
         except Exception as e:
             db.rollback()
@@ -343,10 +459,13 @@ class DBHandler:
                 entry_date_time=current_time,
             )
             db.add(new_user_org)
+            self.__touch_orgs(db, [org_id])
             db.commit()
         except Exception:
             db.rollback()
             raise HTTPException(status_code=500, detail='Failed to add user to organization')
+        invalidate_auth_context(db, user_id)
+        fragment_cache.invalidate(org_id)
 
     def get_org_name_by_id(self, db: DBSession, org_id: str) -> str:
         db_org = db.query(Org).filter(Org.id == org_id).first()
@@ -354,124 +473,389 @@ class DBHandler:
             return db_org.name
         return ""
 
-    def update_events_for_team(self, session_user_id, org_id, team_id: str, events: List[EventSchema], db: DBSession) \
-            -> bool:
-        try:
-            session_user_team = db.query(UserTeam).filter_by(user_id=session_user_id, team_id=team_id).first()
-            team = db.query(Team).filter_by(id=team_id, org_id=org_id).first()
-            if team is None:
-                raise HTTPException(status_code=404, detail='Team not found')
-            if not (self.__is_owner(session_user_id, team.owner_id) or (session_user_team is not None and
-                                                                        session_user_team.is_admin)):
-                raise HTTPException(status_code=403, detail='Only the team owner and the admins'
-                                                            ' are allowed to modify events here')
-
-            db_team_events = db.query(TeamEvent).filter(TeamEvent.team_id == team_id).all()
-
-            # Find events to delete
-            team_events_to_delete = []
-            for db_team_event in db_team_events:
-                if db_team_event.event_id not in [event.id for event in events]:
-                    team_events_to_delete.append(db_team_event)
-
-            # Delete events from the database
-            for team_event in team_events_to_delete:
-                self.__event_ids_for_optimization.append(team_event.event_id)
-                db.delete(team_event)
+    def __check_team_events_editable(self, db: DBSession, session_user_id, org_id, team_id: str) -> None:
+        if get_auth_context(db, session_user_id).can_edit_team(team_id, org_id):
+            return
+        if not self.team_exists_in_org(db, team_id, org_id):
+            raise HTTPException(status_code=404, detail='Team not found')
+        raise HTTPException(status_code=403, detail='Only the team owner and the admins'
+                                                        ' are allowed to modify events here')
 
-            self.__update_events(events, EventAllocation.Team, team_id, db)
+    def update_events_for_team(self, session_user_id, org_id, team_id: str, events: List[EventSchema], db: DBSession,
+                               start: Optional[datetime] = None, end: Optional[datetime] = None) -> bool:
+        try:
+            self.__check_team_events_editable(db, session_user_id, org_id, team_id)
+            changed_events, unlinked_ids = self.__update_events(events, EventAllocation.Team, team_id, db, start, end)
+            self.delete_unused_events(db, unlinked_ids)
+            self.__touch_orgs(db, [org_id])
 
             db.commit()
-            return True
-
         except Exception as e:
             db.rollback()
             raise e
 
-    def update_events_for_user(self, user_id: str, events: List[EventSchema], db: DBSession) -> bool:
+        self.__publish_calendar_changes(db, [org_id],
+                                        self.__to_pushed_events(changed_events, EventAllocation.Team, team_id),
+                                        unlinked_ids)
+        return True
+
+    def update_events_for_user(self, user_id: str, events: List[EventSchema], db: DBSession,
+                               start: Optional[datetime] = None, end: Optional[datetime] = None) -> bool:
         try:
-            db_user_events = db.query(UserEvent).filter(UserEvent.user_id == user_id).all()
+            changed_events, unlinked_ids = self.__update_events(events, EventAllocation.User, user_id, db, start, end)
+            self.delete_unused_events(db, unlinked_ids)
+            # a member's events are shown in the calendars of all of their organizations
+            self.__touch_orgs_of_user(db, user_id)
 
-            # Find events to delete
-            user_events_to_delete = []
-            for db_user_event in db_user_events:
-                if db_user_event.event_id not in [event.id for event in events]:
-                    user_events_to_delete.append(db_user_event)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
 
-            # Delete events from the database
-            for user_event in user_events_to_delete:
-                self.__event_ids_for_optimization.append(user_event.event_id)
-                db.delete(user_event)
+        self.__publish_calendar_changes(db, get_auth_context(db, user_id).org_ids,
+                                        self.__to_pushed_events(changed_events, EventAllocation.User, user_id),
+                                        unlinked_ids)
+        return True
 
-            self.__update_events(events, EventAllocation.User, user_id, db)
+    def update_org_calendar(self, session_user_id, org_id: str, calendar_details: PostOrgCalendarSchema,
+                            db: DBSession) -> bool:
+        # one transaction, so an event moved from a member to a team row is relinked and not collected in between
+        try:
+            start, end = calendar_details.start, calendar_details.end
+            changed_events, member_unlinked_ids = self.__update_events(
+                calendar_details.memberEvents.events, EventAllocation.User, session_user_id, db, start, end)
+            member_events = self.__to_pushed_events(changed_events, EventAllocation.User, session_user_id)
+            team_events, team_unlinked_ids = [], set()
+            for team in calendar_details.teamsEvents:
+                self.__check_team_events_editable(db, session_user_id, org_id, team.team_id)
+                changed_events, unlinked_ids = self.__update_events(team.events, EventAllocation.Team, team.team_id,
+                                                                    db, start, end)
+                team_events += self.__to_pushed_events(changed_events, EventAllocation.Team, team.team_id)
+                team_unlinked_ids |= unlinked_ids
+            self.delete_unused_events(db, member_unlinked_ids | team_unlinked_ids)
+            self.__touch_orgs_of_user(db, session_user_id)
 
             db.commit()
-            return True
-
         except Exception as e:
             db.rollback()
             raise e
 
-    def delete_unused_events(self, db: DBSession) -> bool:
-        if len(self.__event_ids_for_optimization) != 0:
-            unused_events = db.query(Event) \
-                .options(joinedload(Event.users), joinedload(Event.teams)) \
-                .filter(
-                Event.id.in_(self.__event_ids_for_optimization),
-                Event.users == null(),
-                Event.teams == null()
-            ) \
-                .all()
-            for event in unused_events:
-                db.delete(event)
-            db.commit()
-            self.__event_ids_for_optimization.clear()
+        # member events first: an event moved to a team row is removed from the member row before it is added again
+        self.__publish_calendar_changes(db, get_auth_context(db, session_user_id).org_ids, member_events,
+                                        member_unlinked_ids)
+        self.__publish_calendar_changes(db, [org_id], team_events, team_unlinked_ids)
         return True
 
+    def delete_unused_events(self, db: DBSession, event_ids: set) -> int:
+        # runs inside the caller's transaction, only the given candidates are checked
+        if not event_ids:
+            return 0
+        return db.query(Event) \
+            .filter(Event.id.in_(event_ids),
+                    ~exists().where(UserEvent.event_id == Event.id),
+                    ~exists().where(TeamEvent.event_id == Event.id)) \
+            .delete(synchronize_session=False)
+
+    def __get_event_link(self, event_allocation: EventAllocation):
+        if event_allocation == EventAllocation.User:
+            return UserEvent, UserEvent.user_id
+        return TeamEvent, TeamEvent.team_id
+
+    def __normalize_recurrence(self, rule: Optional[str]) -> Optional[str]:
+        try:
+            return normalize_rule(rule)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f'Invalid recurrence rule: {e}')
+
+    def __to_event_mapping(self, event: EventChangeSchema, priority_ids: dict) -> dict:
+        start_point, end_point = to_naive_utc(event.start_point), to_naive_utc(event.end_point)
+        return {
+            'title': event.title,
+            'memo': event.memo,
+            'start_point': start_point,
+            'end_point': end_point,
+            'priority_id': priority_ids[event.event_priority],
+            'recurrence': event.recurrence,
+            'recurrence_end': recurrence_end(start_point, end_point, event.recurrence),
+        }
+
     def __update_events(self, events: List[EventSchema], event_allocation: EventAllocation, allocation_id: str,
-                        db: DBSession) -> bool:
+                        db: DBSession, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> Tuple[List[EventSchema], set]:
+        # returns the events that were inserted, changed or linked, and the ids unlinked from the allocation
+        link_table, allocation_column = self.__get_event_link(event_allocation)
+        submitted_ids = {event.id for event in events if event.id != ''}
+
+        priority_ids = {priority.name: priority.id for priority in db.query(EventPriority).all()}
+        for event in events:
+            if event.event_priority not in priority_ids:
+                raise HTTPException(status_code=404, detail=f"Event priority '{event.event_priority}' not found")
+            event.recurrence = self.__normalize_recurrence(event.recurrence)
+
+        # only events inside the window the client has loaded may be deleted
+        linked_ids_in_window = {
+            event_id for event_id, in db.query(link_table.event_id)
+            .join(Event, link_table.event_id == Event.id)
+            .filter(allocation_column == allocation_id, *self.__event_window_filter(start, end))
+        }
+        ids_to_unlink = linked_ids_in_window - submitted_ids
+        if ids_to_unlink:
+            db.query(link_table) \
+                .filter(allocation_column == allocation_id, link_table.event_id.in_(ids_to_unlink)) \
+                .delete(synchronize_session=False)
+
+        existing_events, linked_ids = {}, set()
+        if submitted_ids:
+            existing_events = {
+                row.id: row for row in db.query(Event.id, Event.version, Event.title, Event.memo, Event.priority_id,
+                                                Event.recurrence, Event.start_point, Event.end_point)
+                .filter(Event.id.in_(submitted_ids))
+            }
+            linked_ids = {
+                event_id for event_id, in db.query(link_table.event_id)
+                .filter(allocation_column == allocation_id, link_table.event_id.in_(submitted_ids))
+            }
+
+        # occurrences of a recurring event share the id of its series, which is stored once
+        entries_by_id, unique_events, seen_ids = {}, [], set()
         for event in events:
-            db_event = None
-            if event.id != '':
-                db_event = db.query(Event).filter(Event.id == event.id).first()
+            if event.id in existing_events:
+                entries_by_id.setdefault(event.id, []).append(event)
+            elif event.id == '' or event.id not in seen_ids:
+                seen_ids.add(event.id)
+                unique_events.append(event)
+        events = unique_events + [
+            self.__pick_series_entry(existing_events[event_id], entries, priority_ids, start, end)
+            for event_id, entries in entries_by_id.items()
+        ]
 
-            event_priority = db.query(EventPriority).filter(EventPriority.name == event.event_priority).first()
+        existing_ids = set(existing_events)
+        new_events = [event for event in events if event.id not in existing_ids]
+        for event in new_events:
+            event.id = generate_id()
 
-            if not event_priority:
+        updated_events = []
+        for event in events:
+            existing_event = existing_events.get(event.id)
+            if existing_event is None:
+                event.version = 1
+                continue
+            mapping = self.__to_event_mapping(event, priority_ids)
+            # only a changed row gets a new version, the others are left alone and not published
+            if any(mapping[column] != getattr(existing_event, column) for column in CHANGE_TRACKED_EVENT_COLUMNS):
+                event.version = existing_event.version + 1
+                updated_events.append(dict(mapping, id=event.id, version=event.version))
+            else:
+                event.version = existing_event.version
+
+        db.bulk_update_mappings(Event, updated_events)
+        db.bulk_insert_mappings(Event, [
+            dict(self.__to_event_mapping(event, priority_ids), id=event.id) for event in new_events
+        ])
+        db.bulk_insert_mappings(link_table, [
+            {allocation_column.key: allocation_id, 'event_id': event.id}
+            for event in events if event.id not in linked_ids
+        ])
+
+        updated_ids = {mapping['id'] for mapping in updated_events}
+        changed_events = [event for event in events
+                          if event.id in updated_ids or event.id not in existing_ids or event.id not in linked_ids]
+        return changed_events, ids_to_unlink
+
+    def __pick_series_entry(self, existing_event, entries: List[EventSchema], priority_ids: dict,
+                            start: Optional[datetime], end: Optional[datetime]) -> EventSchema:
+        # the full save submits every loaded occurrence of a series, at most one of them may differ from the series;
+        # the series keeps its first occurrence unless the changed one was moved
+        def is_stored_occurrence(entry: EventSchema) -> bool:
+            entry_start, entry_end = to_naive_utc(entry.start_point), to_naive_utc(entry.end_point)
+            if not existing_event.recurrence:
+                return (entry_start, entry_end) == (existing_event.start_point, existing_event.end_point)
+            return is_occurrence(existing_event.start_point, existing_event.end_point, existing_event.recurrence,
+                                 entry_start, entry_end)
+
+        changed_entries = {}
+        for entry in entries:
+            if entry.title != existing_event.title or entry.memo != existing_event.memo or \
+                    priority_ids[entry.event_priority] != existing_event.priority_id or \
+                    entry.recurrence != existing_event.recurrence or not is_stored_occurrence(entry):
+                changed_entries.setdefault((entry.title, entry.memo, entry.event_priority, entry.recurrence,
+                                            to_naive_utc(entry.start_point), to_naive_utc(entry.end_point)), entry)
+        if len(changed_entries) > 1:
+            raise HTTPException(status_code=422, detail='Only one occurrence of a recurring event can be changed'
+                                                        ' per save')
+
+        entry = next(iter(changed_entries.values()), entries[0])
+        if not existing_event.recurrence or entry.recurrence != existing_event.recurrence:
+            # a new rule starts the series at the submitted occurrence
+            return entry
+        if is_stored_occurrence(entry):
+            entry.start_point, entry.end_point = existing_event.start_point, existing_event.end_point
+            return entry
+
+        # the moved occurrence is the one missing from its place, the whole series moves along with it
+        entry_start, entry_end = to_naive_utc(entry.start_point), to_naive_utc(entry.end_point)
+        submitted_times = [(to_naive_utc(other.start_point), to_naive_utc(other.end_point)) for other in entries]
+        window_start = to_naive_utc(start) or min(other_start for other_start, _ in submitted_times)
+        window_end = to_naive_utc(end) or max(other_end for _, other_end in submitted_times)
+        if window_end - window_start > MAX_EXPANSION_WINDOW:
+            raise HTTPException(status_code=422, detail='The occurrences of a moved recurring event may span at most'
+                                                        f' {RECURRENCE_MAX_WINDOW_DAYS} days')
+        missing = [occurrence for occurrence in expand_occurrences(
+            existing_event.start_point, existing_event.end_point, existing_event.recurrence, window_start, window_end)
+            if occurrence not in submitted_times]
+        if len(missing) == 1:
+            (occurrence_start, occurrence_end), = missing
+            entry.start_point = existing_event.start_point + (entry_start - occurrence_start)
+            entry.end_point = existing_event.end_point + (entry_end - occurrence_end)
+            if is_occurrence(entry.start_point, entry.end_point, entry.recurrence, entry_start, entry_end):
+                return entry
+        raise HTTPException(status_code=422, detail='The moved occurrence of a recurring event cannot be applied to'
+                                                    ' its series')
+
+    def apply_calendar_changes(self, session_user_id, org_id: str, changes: PostCalendarChangesSchema,
+                               db: DBSession) -> CalendarChangesResultSchema:
+        client_ids = [event.client_id for event in changes.created]
+        if len(set(client_ids)) != len(client_ids):
+            raise HTTPException(status_code=422, detail='Created events need distinct client ids')
+
+        editable_team_ids = get_auth_context(db, session_user_id).editable_team_ids(org_id)
+        priority_ids = {priority.name: priority.id for priority in db.query(EventPriority).all()}
+        for event in changes.created + changes.updated:
+            if event.event_priority not in priority_ids:
                 raise HTTPException(status_code=404, detail=f"Event priority '{event.event_priority}' not found")
+            event.recurrence = self.__normalize_recurrence(event.recurrence)
+        for event in changes.created:
+            if event.team_id is not None and event.team_id not in editable_team_ids:
+                raise HTTPException(status_code=403, detail='Only the team owner and the admins'
+                                                            ' are allowed to modify events here')
 
-            if db_event:
-                db_event.title = event.title
-                db_event.memo = event.memo
-                db_event.start_point = event.start_point.replace(tzinfo=None)
-                db_event.end_point = event.end_point.replace(tzinfo=None)
-                db_event.priority_id = event_priority.id
-            else:
-                new_event = Event(
-                    id=self.__get_unique_uuid(db, Event),
-                    title=event.title,
-                    memo=event.memo,
-                    start_point=event.start_point.replace(tzinfo=None),
-                    end_point=event.end_point.replace(tzinfo=None),
-                    priority_id=event_priority.id
-                )
-                db.add(new_event)
-                event.id = new_event.id
-
-            if event_allocation == EventAllocation.User:
-                user_event = db.query(UserEvent).filter(UserEvent.user_id == allocation_id,
-                                                        UserEvent.event_id == event.id).first()
-                if not user_event:
-                    user_event = UserEvent(user_id=allocation_id, event_id=event.id)
-                    db.add(user_event)
-            elif event_allocation == EventAllocation.Team:
-                team_event = db.query(TeamEvent).filter(TeamEvent.team_id == allocation_id,
-                                                        TeamEvent.event_id == event.id).first()
-                if not team_event:
-                    team_event = TeamEvent(team_id=allocation_id, event_id=event.id)
-                    db.add(team_event)
+        expected_versions = {event.id: event.version for event in changes.updated + changes.deleted}
+        db_events = db.query(Event) \
+            .options(selectinload(Event.users), selectinload(Event.teams)) \
+            .filter(Event.id.in_(expected_versions)) \
+            .all()
+        if len(db_events) != len(expected_versions):
+            raise HTTPException(status_code=404, detail='Event not found')
+        for db_event in db_events:
+            if not (any(user_event.user_id == session_user_id for user_event in db_event.users) or
+                    any(team_event.team_id in editable_team_ids for team_event in db_event.teams)):
+                raise HTTPException(status_code=403, detail='You are not allowed to modify this event')
+        stale_ids = [db_event.id for db_event in db_events if db_event.version != expected_versions[db_event.id]]
+        if stale_ids:
+            raise HTTPException(status_code=409, detail={'message': 'Events were modified in the meantime',
+                                                         'stale_event_ids': stale_ids})
+        # like the full save: an update at the times of one of the occurrences keeps the start of the series, other
+        # times move the series
+        stored_events = {db_event.id: db_event for db_event in db_events}
+        for event in changes.updated:
+            db_event = stored_events[event.id]
+            if db_event.recurrence and db_event.recurrence == event.recurrence and \
+                    is_occurrence(db_event.start_point, db_event.end_point, db_event.recurrence,
+                                  to_naive_utc(event.start_point), to_naive_utc(event.end_point)):
+                event.start_point, event.end_point = db_event.start_point, db_event.end_point
+        # the loaded events expire with the commit, their links are needed to publish the changes
+        event_links = {
+            db_event.id: (EventAllocation.User, db_event.users[0].user_id) if db_event.users
+            else (EventAllocation.Team, db_event.teams[0].team_id)
+            for db_event in db_events if db_event.users or db_event.teams
+        }
 
-        return True
+        try:
+            versions = {}
+            for event in changes.updated:
+                # the version condition guards against edits committed since the check above
+                updated_rows = db.query(Event) \
+                    .filter(Event.id == event.id, Event.version == event.version) \
+                    .update(dict(self.__to_event_mapping(event, priority_ids), version=Event.version + 1),
+                            synchronize_session=False)
+                if updated_rows == 0:
+                    raise HTTPException(status_code=409, detail={'message': 'Events were modified in the meantime',
+                                                                 'stale_event_ids': [event.id]})
+                versions[event.id] = event.version + 1
+
+            deleted_ids = [event.id for event in changes.deleted]
+            if deleted_ids:
+                db.query(UserEvent).filter(UserEvent.event_id.in_(deleted_ids)).delete(synchronize_session=False)
+                db.query(TeamEvent).filter(TeamEvent.event_id.in_(deleted_ids)).delete(synchronize_session=False)
+            for event in changes.deleted:
+                deleted_rows = db.query(Event) \
+                    .filter(Event.id == event.id, Event.version == event.version) \
+                    .delete(synchronize_session=False)
+                if deleted_rows == 0:
+                    raise HTTPException(status_code=409, detail={'message': 'Events were modified in the meantime',
+                                                                 'stale_event_ids': [event.id]})
+
+            created_ids = {event.client_id: generate_id() for event in changes.created}
+            db.bulk_insert_mappings(Event, [
+                dict(self.__to_event_mapping(event, priority_ids), id=created_ids[event.client_id], version=1)
+                for event in changes.created
+            ])
+            db.bulk_insert_mappings(UserEvent, [
+                {'user_id': session_user_id, 'event_id': created_ids[event.client_id]}
+                for event in changes.created if event.team_id is None
+            ])
+            db.bulk_insert_mappings(TeamEvent, [
+                {'team_id': event.team_id, 'event_id': created_ids[event.client_id]}
+                for event in changes.created if event.team_id is not None
+            ])
+            versions.update({event_id: 1 for event_id in created_ids.values()})
+
+            self.__touch_orgs_of_user(db, session_user_id)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+
+        pushed_events = [
+            self.__to_pushed_event(created_ids[event.client_id], event, 1,
+                                   *((EventAllocation.Team, event.team_id) if event.team_id is not None
+                                     else (EventAllocation.User, session_user_id)))
+            for event in changes.created
+        ]
+        pushed_events += [
+            self.__to_pushed_event(event.id, event, versions[event.id], *event_links[event.id])
+            for event in changes.updated if event.id in event_links
+        ]
+        # member events are shown in every organization of the member, team events only in the one of the team
+        member_deleted_ids = {event_id for event_id in deleted_ids
+                              if event_links.get(event_id, (None,))[0] == EventAllocation.User}
+        self.__publish_calendar_changes(db, get_auth_context(db, session_user_id).org_ids,
+                                        [event for event in pushed_events if event['allocation'] == 'member'],
+                                        member_deleted_ids)
+        self.__publish_calendar_changes(db, [org_id],
+                                        [event for event in pushed_events if event['allocation'] == 'team'],
+                                        set(deleted_ids) - member_deleted_ids)
+
+        return CalendarChangesResultSchema(created=created_ids, versions=versions, deleted=deleted_ids)
+
+    def __to_pushed_event(self, event_id: str, event: EventChangeSchema, version: int,
+                          event_allocation: EventAllocation, allocation_id: str) -> dict:
+        # same shape as the calendar events endpoint, the allocation replaces the viewer dependent resourceIds
+        return {
+            'id': event_id,
+            'title': event.title,
+            'start': to_iso_utc(event.start_point),
+            'end': to_iso_utc(event.end_point),
+            'allocation': 'member' if event_allocation == EventAllocation.User else 'team',
+            'allocationId': allocation_id,
+            'extendedProps': {'priority': event.event_priority, 'memo': event.memo, 'customTitle': event.title,
+                              'version': version, 'recurrence': event.recurrence},
+        }
+
+    def __to_pushed_events(self, events: List[EventSchema], event_allocation: EventAllocation,
+                           allocation_id: str) -> List[dict]:
+        return [self.__to_pushed_event(event.id, event, event.version, event_allocation, allocation_id)
+                for event in events]
+
+    def __publish_calendar_changes(self, db: DBSession, org_ids, pushed_events: List[dict], removed_ids) -> None:
+        # the origin lets the tab that saved skip its own changes
+        if pushed_events or removed_ids:
+            calendar_broker.publish(org_ids, {
+                'type': 'changes',
+                'origin': db.info.get('calendar_client_id'),
+                'removed': sorted(removed_ids),
+                'events': pushed_events,
+            })
 
     def get_user_id_and_password(self, db: DBSession, username: str):
         db_user = db.query(User.id, User.password).filter_by(username=username).first()
@@ -490,30 +874,42 @@ class DBHandler:
             .order_by(desc(Session.expiration_date)) \
             .first()
 
-        if db_session:
-            tmp_id = db_session.id
-            db_session.expiration_date = new_expiration_date
-            db_session.latest_activity = current_time
-        else:
-            tmp_id = self.__get_unique_uuid(db, Session)
+        def extend_or_add_session() -> str:
+            if db_session:
+                db_session.expiration_date = new_expiration_date
+                db_session.latest_activity = current_time
+                return db_session.id
+
             new_session = Session(
-                id=tmp_id,
+                id=generate_token(),
                 user_id=user_id,
                 expiration_date=new_expiration_date,
                 latest_activity=current_time,
             )
             db.add(new_session)
+            return new_session.id
 
         try:
-            db.commit()
+            tmp_id = self.__commit_with_new_ids(db, extend_or_add_session)
         except Exception:
             db.rollback()
             raise HTTPException(status_code=500, detail='Failed to update session')
 
+        session_cache.put(tmp_id, CachedSession(user_id, new_expiration_date))
         return tmp_id
 
+    @timed_phase("auth")
     def verify_user_session(self, db: DBSession, token: str) -> str:
         current_time = datetime.utcnow().replace(tzinfo=None)
+        new_expiration_date = add_amount_of_days(current_time, 28)
+        refresh_threshold = timedelta(minutes=SESSION_REFRESH_THRESHOLD_MINUTES)
+
+        # the sliding expiration is only written back once the stored one lags behind by the threshold
+        cached_session = session_cache.get(token) if token else None
+        if cached_session is not None and cached_session.expiration_date > current_time and \
+                new_expiration_date - cached_session.expiration_date < refresh_threshold:
+            return cached_session.user_id
+
         db_session = db.query(Session) \
             .filter(Session.id == token) \
             .filter(Session.expiration_date > current_time) \
@@ -521,15 +917,19 @@ class DBHandler:
             .first()
 
         if db_session is not None:
-            db_session.expiration_date = add_amount_of_days(current_time, 28)
-            db_session.latest_activity = current_time
-            db.commit()
+            if new_expiration_date - db_session.expiration_date >= refresh_threshold:
+                db_session.expiration_date = new_expiration_date
+                db_session.latest_activity = current_time
+                db.commit()
 
+            session_cache.put(token, CachedSession(db_session.user_id, db_session.expiration_date))
             return db_session.user_id
         else:
+            session_cache.invalidate(token)
             raise HTTPException(status_code=403, detail='Session has expired or was not found')
 
     def end_session(self, db: DBSession, token: str) -> bool:
+        session_cache.invalidate(token)
         db_session = db.query(Session) \
             .filter(Session.id == token) \
             .first()
@@ -543,69 +943,275 @@ class DBHandler:
         else:
             return False
 
-    def __format_events_to_event_schemas(self, events: List[Event]) -> List[EventSchema]:
-        events_schemas = []
-        for event in events:
-            event_schema = EventSchema(
-                id=event.id,
-                title=event.title,
-                memo=event.memo,
-                start_point=event.start_point,
-                end_point=event.end_point,
-                event_priority=event.priority.name,
-            )
-            events_schemas.append(event_schema)
-        return events_schemas
-
-    def __format_user_events_to_event_schemas(self, user_events: List[UserEvent]) -> List[EventSchema]:
-        events = []
-        for user_event in user_events:
-            events.append(user_event.event)
-        return self.__format_events_to_event_schemas(events)
-
-    def __format_team_events_to_event_schemas(self, team_events: List[TeamEvent]) -> List[EventSchema]:
-        events = []
-        for user_event in team_events:
-            events.append(user_event.event)
-        return self.__format_events_to_event_schemas(events)
-
-    def __format_members_to_member_with_events_schemas(self, session_user_id: str, users: List[UserTeam]) -> \
-            List[MemberEventsSchema]:
-        members = []
-        for user_team in users:
-            member = MemberEventsSchema(
-                user_id=user_team.user_id,
-                username=user_team.user.username,
-                is_editable=user_team.user_id == session_user_id,
-                events=self.__format_user_events_to_event_schemas(user_team.user.events),
-            )
-            members.append(member)
-        return members
-
-    def get_team_with_events_schema(self, session_user_id, team_id: str, db: DBSession) -> TeamEventsMembersSchema:
-        db_team = db.query(Team).filter(Team.id == team_id).first()
-        session_user_team = db.query(UserTeam).filter_by(user_id=session_user_id, team_id=team_id).first()
-
-        if db_team:
-            return TeamEventsMembersSchema(
-                team_id=team_id,
+    def __expand_event_row(self, event: EventRow, start: Optional[datetime], end: Optional[datetime]) -> list:
+        # a recurring event is returned once per occurrence in the window, or only as its series without a window
+        if event.recurrence and start is not None and end is not None:
+            return [event._replace(start_point=start_point, end_point=end_point)
+                    for start_point, end_point in expand_occurrences(event.start_point, event.end_point,
+                                                                     event.recurrence, to_naive_utc(start),
+                                                                     to_naive_utc(end))]
+        return [event]
+
+    def __get_event_rows_by_allocation(self, db: DBSession, link_table, allocation_column, allocation_ids: List[str],
+                                       start: Optional[datetime], end: Optional[datetime]) -> dict:
+        events_by_allocation = {allocation_id: [] for allocation_id in allocation_ids}
+        if not allocation_ids:
+            return events_by_allocation
+
+        rows = db.query(allocation_column, *EVENT_ROW_COLUMNS) \
+            .join(Event, link_table.event_id == Event.id) \
+            .join(EventPriority, Event.priority_id == EventPriority.id) \
+            .filter(allocation_column.in_(allocation_ids), *self.__event_window_filter(start, end)) \
+            .all()
+        for row in rows:
+            events_by_allocation[row[0]].extend(self.__expand_event_row(EventRow(*row[1:]), start, end))
+        return events_by_allocation
+
+    def __build_calendar_rows(self, session_user_id: str, db_teams: List[Team], db: DBSession,
+                              start: Optional[datetime], end: Optional[datetime],
+                              include_events: bool) -> List[CalendarTeamRows]:
+        # teams and memberships are expected to be loaded already, events are fetched with one query per link table
+        team_ids = [db_team.id for db_team in db_teams]
+        user_ids = list({user_team.user_id for db_team in db_teams for user_team in db_team.users})
+        team_events, user_events = {}, {}
+        if include_events:
+            team_events = self.__get_event_rows_by_allocation(db, TeamEvent, TeamEvent.team_id, team_ids, start, end)
+            user_events = self.__get_event_rows_by_allocation(db, UserEvent, UserEvent.user_id, user_ids, start, end)
+
+        teams = []
+        for db_team in db_teams:
+            session_user_team = next((user_team for user_team in db_team.users
+                                      if user_team.user_id == session_user_id), None)
+            members = [
+                CalendarMemberRows(
+                    user_id=user_team.user_id,
+                    username=user_team.user.username,
+                    is_editable=user_team.user_id == session_user_id,
+                    events=user_events.get(user_team.user_id, []),
+                )
+                for user_team in db_team.users
+            ]
+            teams.append(CalendarTeamRows(
+                team_id=db_team.id,
                 team_name=db_team.name,
-                # owner_id=db_team.owner_id,
                 is_editable=(db_team.owner_id == session_user_id or
                              (session_user_team is not None and session_user_team.is_admin)),
-                events=self.__format_team_events_to_event_schemas(db_team.events),
-                members=self.__format_members_to_member_with_events_schemas(session_user_id, db_team.users),
+                events=team_events.get(db_team.id, []),
+                members=members,
+            ))
+        return teams
+
+    def __get_org_calendar_rows(self, session_user_id, org_id: str, db: DBSession, start: Optional[datetime],
+                                end: Optional[datetime], include_events: bool = True) -> List[CalendarTeamRows]:
+        db_teams = self.__get_teams_by_org(org_id, db)
+        teams = self.__build_calendar_rows(session_user_id, db_teams, db, start, end, include_events)
+        teams.sort(key=lambda team: team.team_name)
+        return teams
+
+    def __to_team_schemas(self, teams: List[CalendarTeamRows]) -> List[TeamEventsMembersSchema]:
+        return [
+            TeamEventsMembersSchema(
+                team_id=team.team_id,
+                team_name=team.team_name,
+                is_editable=team.is_editable,
+                events=[EventSchema(**event._asdict()) for event in team.events],
+                members=[
+                    MemberEventsSchema(
+                        user_id=member.user_id,
+                        username=member.username,
+                        is_editable=member.is_editable,
+                        events=[EventSchema(**event._asdict()) for event in member.events],
+                    )
+                    for member in team.members
+                ],
             )
-
-    def get_org_calendar_details(self, session_user_id, org_id: str, db: DBSession) -> OrgCalendarSchema:
-        team_ids = self.__get_team_ids_by_org(org_id, db)
-        teams = [
-            self.get_team_with_events_schema(session_user_id, team_id, db)
-            for team_id in team_ids
+            for team in teams
         ]
-        teams.sort(key=lambda team: team.team_name)
-        return OrgCalendarSchema(teams=teams)
 
+    @timed_phase("schema")
+    def get_team_with_events_schema(self, session_user_id, team_id: str, db: DBSession,
+                                    start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    include_events: bool = True) -> TeamEventsMembersSchema:
+        db_team = db.query(Team) \
+            .options(selectinload(Team.users).joinedload(UserTeam.user)) \
+            .filter(Team.id == team_id) \
+            .first()
+
+        if db_team:
+            return self.__to_team_schemas(self.__build_calendar_rows(session_user_id, [db_team], db, start, end,
+                                                                     include_events))[0]
+
+    @timed_phase("schema")
+    def get_org_calendar_details(self, session_user_id, org_id: str, db: DBSession,
+                                 start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                 include_events: bool = True) -> OrgCalendarSchema:
+        teams = self.__get_org_calendar_rows(session_user_id, org_id, db, start, end, include_events)
+        return OrgCalendarSchema(teams=self.__to_team_schemas(teams))
+
+    def __encode_event_rows(self, rows, key_length: int, start: Optional[datetime],
+                            end: Optional[datetime]) -> Iterator[str]:
+        # events in the shape of EventSchema, the first key_length columns of the rows are the group key; the times
+        # are written like the schema writes the stored naive ones
+        separator = ''
+        for row in rows:
+            for event in self.__expand_event_row(EventRow(*row[key_length:]), start, end):
+                yield separator + json.dumps({
+                    'id': event.id,
+                    'title': event.title,
+                    'memo': event.memo,
+                    'start_point': event.start_point.isoformat(),
+                    'end_point': event.end_point.isoformat(),
+                    'event_priority': event.event_priority,
+                    'version': event.version,
+                    'recurrence': event.recurrence,
+                }, separators=(',', ':'))
+                separator = ','
+
+    def iter_org_calendar_json(self, session_user_id, org_id: str, db: DBSession, start: Optional[datetime] = None,
+                               end: Optional[datetime] = None) -> Iterator[str]:
+        # the OrgCalendarSchema document written team by team and member by member, events are read through
+        # server-side cursors in the same order, so only one batch of rows is held at a time
+        memberships = db.query(Team.id, Team.name, Team.owner_id, UserTeam.user_id, User.username, UserTeam.is_admin) \
+            .outerjoin(UserTeam, UserTeam.team_id == Team.id) \
+            .outerjoin(User, User.id == UserTeam.user_id) \
+            .filter(Team.org_id == org_id) \
+            .order_by(Team.name, Team.id, UserTeam.user_id) \
+            .all()
+        teams = {}
+        for team_id, team_name, owner_id, user_id, username, is_admin in memberships:
+            members = teams.setdefault(team_id, (team_name, owner_id, []))[2]
+            if user_id is not None:
+                members.append((user_id, username, is_admin))
+        if not teams:
+            yield '{"teams":[]}'
+            return
+
+        # the cursors follow the team order read above by id, ordering them by name again would let a rename in
+        # between put the rows of the renamed team out of place, and RowGroups would skip them
+        team_order = case({team_id: index for index, team_id in enumerate(teams)}, value=Team.id, else_=len(teams))
+        window = self.__event_window_filter(start, end)
+        team_rows = db.query(Team.id, *EVENT_ROW_COLUMNS) \
+            .join(TeamEvent, TeamEvent.team_id == Team.id) \
+            .join(Event, TeamEvent.event_id == Event.id) \
+            .join(EventPriority, Event.priority_id == EventPriority.id) \
+            .filter(Team.org_id == org_id, *window) \
+            .order_by(team_order, Team.id) \
+            .yield_per(STREAM_YIELD_PER)
+        member_rows = db.query(Team.id, UserTeam.user_id, *EVENT_ROW_COLUMNS) \
+            .join(UserTeam, UserTeam.team_id == Team.id) \
+            .join(UserEvent, UserEvent.user_id == UserTeam.user_id) \
+            .join(Event, UserEvent.event_id == Event.id) \
+            .join(EventPriority, Event.priority_id == EventPriority.id) \
+            .filter(Team.org_id == org_id, *window) \
+            .order_by(team_order, Team.id, UserTeam.user_id) \
+            .yield_per(STREAM_YIELD_PER)
+        team_events = RowGroups(team_rows, lambda row: row[0], set(teams))
+        member_events = RowGroups(member_rows, lambda row: (row[0], row[1]),
+                                  {(team_id, member[0]) for team_id, team in teams.items() for member in team[2]})
+
+        yield '{"teams":['
+        for team_index, (team_id, (team_name, owner_id, members)) in enumerate(teams.items()):
+            is_editable = owner_id == session_user_id or any(user_id == session_user_id and is_admin
+                                                             for user_id, _, is_admin in members)
+            team_header = json.dumps({'team_id': team_id, 'team_name': team_name, 'is_editable': is_editable},
+                                     separators=(',', ':'))
+            yield (',' if team_index else '') + team_header[:-1] + ',"events":['
+            yield from self.__encode_event_rows(team_events.take(team_id), 1, start, end)
+            yield '],"members":['
+            for member_index, (user_id, username, _) in enumerate(members):
+                member_header = json.dumps({'user_id': user_id, 'username': username,
+                                            'is_editable': user_id == session_user_id}, separators=(',', ':'))
+                yield (',' if member_index else '') + member_header[:-1] + ',"events":['
+                yield from self.__encode_event_rows(member_events.take((team_id, user_id)), 2, start, end)
+                yield ']}'
+            yield ']}'
+        yield ']}'
+
+    @timed_phase("schema")
+    def get_org_calendar_events(self, session_user_id, org_id: str, start: datetime, end: datetime,
+                                db: DBSession) -> List[dict]:
+        # built straight from the rows in the shape FullCalendar expects, the data comes from our own database
+        teams = self.__get_org_calendar_rows(session_user_id, org_id, db, start, end)
+
+        def to_calendar_event(event: EventRow, editable: bool, resource_ids: List[str]) -> dict:
+            return {
+                'id': event.id,
+                'title': event.title,
+                'start': to_iso_utc(event.start_point),
+                'end': to_iso_utc(event.end_point),
+                'editable': editable,
+                'resourceIds': resource_ids,
+                'extendedProps': {'priority': event.event_priority, 'memo': event.memo, 'customTitle': event.title,
+                                  'version': event.version, 'recurrence': event.recurrence},
+            }
+
+        calendar_events = []
+        member_events = {}
+        for team in teams:
+            team_resource_id = f'team{team.team_id}'
+            for event in team.events:
+                calendar_events.append(to_calendar_event(event, team.is_editable, [team_resource_id]))
+
+            # a member's events are shown once per team the member belongs to
+            for member in team.members:
+                member_resource_id = f'member{member.user_id}team{team.team_id}'
+                if member.user_id in member_events:
+                    for calendar_event in member_events[member.user_id]:
+                        calendar_event['resourceIds'].append(member_resource_id)
+                else:
+                    member_events[member.user_id] = [
+                        to_calendar_event(event, member.is_editable, [member_resource_id])
+                        for event in member.events
+                    ]
+                    calendar_events.extend(member_events[member.user_id])
+
+        return calendar_events
+
+    @timed_phase("schema")
+    def get_org_calendar_data(self, session_user_id, org_id: str, db: DBSession,
+                              start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+        # compact wire format: priorities and users are sent once and referenced by index, events are
+        # [id, title, memo, start, end, priority index, version, recurrence, recurrence end] with epoch seconds;
+        # with a window recurring events come as their occurrences, without one as their series, only a series has
+        # a recurrence end, which is null for endless series
+        calendar_teams = self.__get_org_calendar_rows(session_user_id, org_id, db, start, end)
+        priorities = [name for name, in db.query(EventPriority.name).order_by(EventPriority.id)]
+        priority_indexes = {name: index for index, name in enumerate(priorities)}
+        is_expanded = start is not None and end is not None
+
+        def encode_series_end(event: EventRow) -> Optional[int]:
+            series_end = None if is_expanded else recurrence_end(event.start_point, event.end_point, event.recurrence)
+            return to_epoch_seconds(series_end) if series_end is not None else None
+
+        def encode_events(events: List[EventRow]) -> list:
+            return [
+                [event.id, event.title, event.memo, to_epoch_seconds(event.start_point),
+                 to_epoch_seconds(event.end_point), priority_indexes[event.event_priority], event.version,
+                 event.recurrence, encode_series_end(event)]
+                for event in events
+            ]
+
+        users, user_indexes, user_events = [], {}, []
+        teams = []
+        for team in calendar_teams:
+            member_indexes = []
+            for member in team.members:
+                if member.user_id not in user_indexes:
+                    user_indexes[member.user_id] = len(users)
+                    users.append([member.user_id, member.username])
+                    user_events.append(encode_events(member.events))
+                member_indexes.append(user_indexes[member.user_id])
+            teams.append([team.team_id, team.team_name, team.is_editable, member_indexes, encode_events(team.events)])
+
+        return {
+            "user_id": session_user_id,
+            "priorities": priorities,
+            "users": users,
+            "teams": teams,
+            "user_events": user_events,
+        }
+
+    @timed_phase("schema")
     def get_organization_details(self, org_id: str, db: DBSession) -> OrganizationDetailsSchema:
         if not self.org_exists(db, org_id):
             raise HTTPException(status_code=404, detail='Organization not found')
@@ -691,6 +1297,75 @@ class DBHandler:
             members=members,
         )
 
+    def get_team_availability(self, db: DBSession, org_id, team_id: str, start: datetime, end: datetime,
+                              min_duration: timedelta, limit: int) -> TeamAvailabilitySchema:
+        if not self.team_exists_in_org(db, team_id, org_id):
+            raise HTTPException(status_code=404, detail='Team not found in organization')
+
+        start, end = to_naive_utc(start), to_naive_utc(end)
+        member_ids = [user_id for user_id, in db.query(UserTeam.user_id).filter(UserTeam.team_id == team_id)]
+        rows = db.query(UserEvent.user_id, Event.start_point, Event.end_point, EventPriority.name, Event.recurrence) \
+            .join(Event, UserEvent.event_id == Event.id) \
+            .join(EventPriority, Event.priority_id == EventPriority.id) \
+            .join(UserTeam, (UserTeam.user_id == UserEvent.user_id) & (UserTeam.team_id == team_id)) \
+            .filter(*self.__event_window_filter(start, end)) \
+            .all()
+        events = expand_rows(rows, start, end)
+
+        windows = rank_windows(compute_availability(events, start, end), min_duration, limit)
+        return TeamAvailabilitySchema(
+            team_id=team_id,
+            member_count=len(member_ids),
+            windows=[AvailabilityWindowSchema(start=window.start.replace(tzinfo=timezone.utc),
+                                              end=window.end.replace(tzinfo=timezone.utc),
+                                              certain=window.certain, possible=window.possible)
+                     for window in windows],
+        )
+
+    def get_org_heatmap(self, db: DBSession, org_id: str, start: datetime, end: datetime, slot: timedelta) -> dict:
+        # counts[team][priority][slot] is the number of team members with an event of that priority in the slot
+        start, end = to_naive_utc(start), to_naive_utc(end)
+        slot_count = -(-(end - start) // slot)
+        teams = db.query(Team.id, Team.name).filter(Team.org_id == org_id).order_by(Team.name).all()
+        memberships = db.query(UserTeam.team_id, UserTeam.user_id) \
+            .join(Team, UserTeam.team_id == Team.id) \
+            .filter(Team.org_id == org_id) \
+            .all()
+        priorities = db.query(EventPriority.id, EventPriority.name).order_by(EventPriority.id).all()
+        rows = db.query(UserEvent.user_id, Event.start_point, Event.end_point, Event.priority_id, Event.recurrence) \
+            .join(Event, UserEvent.event_id == Event.id) \
+            .filter(UserEvent.user_id.in_(select(UserTeam.user_id)
+                                          .join(Team, UserTeam.team_id == Team.id)
+                                          .where(Team.org_id == org_id)),
+                    *self.__event_window_filter(start, end)) \
+            .all()
+        events = expand_rows(rows, start, end)
+
+        team_indexes = {team_id: index for index, (team_id, _) in enumerate(teams)}
+        member_indexes = {}
+        for _, user_id in memberships:
+            member_indexes.setdefault(user_id, len(member_indexes))
+        priority_indexes = {priority_id: index for index, (priority_id, _) in enumerate(priorities)}
+
+        user_ids, starts, ends, priority_ids = zip(*events) if events else ((), (), (), ())
+        counts = build_heatmap(
+            np.array([member_indexes[user_id] for user_id in user_ids], dtype=np.intp),
+            np.array([priority_indexes[priority_id] for priority_id in priority_ids], dtype=np.intp),
+            to_slot_indexes(starts, start, slot, round_up=False).astype(np.intp),
+            to_slot_indexes(ends, start, slot, round_up=True).astype(np.intp),
+            np.array([team_indexes[team_id] for team_id, _ in memberships], dtype=np.intp),
+            np.array([member_indexes[user_id] for _, user_id in memberships], dtype=np.intp),
+            len(teams), len(priorities), slot_count,
+        )
+
+        return {
+            "start": start.replace(tzinfo=timezone.utc).isoformat(),
+            "slot_minutes": slot // timedelta(minutes=1),
+            "priorities": [name for _, name in priorities],
+            "teams": [[team_id, team_name] for team_id, team_name in teams],
+            "counts": counts.tolist(),
+        }
+
     def get_user_organizations(self, db: DBSession, user_id: str) -> OrganizationsSchema:
         db_user_orgs = db.query(UserOrg).filter_by(user_id=user_id).all()
 
@@ -711,40 +1386,37 @@ class DBHandler:
         if session_user_id == schema.user_id:
             raise HTTPException(status_code=409, detail='You are not allowed to change your own role')
 
-        if not self.team_exists_in_org(db, team_id, org_id):
+        db_team = db.query(Team).filter_by(id=team_id, org_id=org_id).first()
+        if db_team is None:
             raise HTTPException(status_code=404, detail='Team not found in organization')
 
-        if not self.is_user_member_of_team(db, schema.user_id, team_id):
+        user_team = next((user_team for user_team in db_team.users if user_team.user_id == schema.user_id), None)
+        if user_team is None:
             raise HTTPException(status_code=404, detail='User does not exist in the team')
 
-        if not self.is_user_member_of_team(db, session_user_id, team_id):
+        auth_context = get_auth_context(db, session_user_id)
+        if not auth_context.is_team_member(team_id):
             raise HTTPException(status_code=403, detail='You are not allowed to modify roles')
 
-        db_team = db.query(Team).filter_by(id=team_id).first()
-
         if db_team.owner_id == schema.user_id:
             raise HTTPException(status_code=409, detail='The role of the owner cannot be changed as of now')
 
-        session_user_team = next((user_team for user_team in db_team.users if user_team.user_id == session_user_id),
-                                 None)
-
-        if not (db_team.owner_id == session_user_id or session_user_team.is_admin):
+        if not auth_context.can_edit_team(team_id):
             raise HTTPException(status_code=403, detail='You are not allowed to modify roles')
 
-        user_team = next((user_team for user_team in db_team.users if user_team.user_id == schema.user_id), None)
-
         if user_team.is_admin == schema.new_admin_state:
             raise HTTPException(status_code=409, detail='The user already has this role')
 
         user_team.is_admin = schema.new_admin_state
+        self.__touch_orgs(db, [org_id])
         db.commit()
+        invalidate_auth_context(db, schema.user_id)
 
         return True
 
     def validate_invite(self, db_invite: Type[TeamInvite]) -> bool:
         now = datetime.utcnow().replace(tzinfo=None)
-        valid_duration = timedelta(hours=24)
-        is_valid = db_invite.create_date_time + valid_duration >= now and not db_invite.used
+        is_valid = db_invite.create_date_time + INVITE_VALID_DURATION >= now and not db_invite.used
 
         return is_valid
 
@@ -765,7 +1437,10 @@ class DBHandler:
                 new_user_team = UserTeam(user_id=session_user_id, team_id=db_invite.team_id, is_admin=False)
                 db.add(new_user_team)
                 db_invite.used = True
+                self.__touch_orgs(db, [db_invite.team.org_id])
                 db.commit()
+                invalidate_auth_context(db, session_user_id)
+                fragment_cache.invalidate(db_invite.team.org_id)
             else:
                 raise HTTPException(status_code=410, detail='Invite is no longer valid')
         else:
@@ -774,23 +1449,19 @@ class DBHandler:
         return db_invite.team.org.id, db_invite.team.id
 
     def generate_invite(self, db: DBSession, org_id, team_id, session_user_id: str) -> str:
-        if not self.team_exists_in_org(db, team_id, org_id):
-            raise HTTPException(status_code=404, detail='Team not found in organization')
-
-        if not self.is_user_member_of_team(db, session_user_id, team_id):
+        auth_context = get_auth_context(db, session_user_id)
+        if not (auth_context.is_team_member(team_id) and auth_context.can_edit_team(team_id, org_id)):
+            if not self.team_exists_in_org(db, team_id, org_id):
+                raise HTTPException(status_code=404, detail='Team not found in organization')
             raise HTTPException(status_code=403, detail='You are not allowed to generate invites for this team')
 
-        db_team = db.query(Team).filter_by(id=team_id).first()
-        session_user_team = next((user_team for user_team in db_team.users if user_team.user_id == session_user_id),
-                                 None)
-
-        if not (db_team.owner_id == session_user_id or session_user_team.is_admin):
-            raise HTTPException(status_code=403, detail='You are not allowed to generate invites for this team')
-
-        new_team_invite = TeamInvite(id=self.__get_unique_uuid(db, TeamInvite),
-                                     create_date_time=datetime.now(timezone.utc).replace(tzinfo=None),
-                                     team_id=team_id)
+        def add_invite() -> str:
+            new_team_invite = TeamInvite(
+                id=generate_token(),
+                create_date_time=datetime.now(timezone.utc).replace(tzinfo=None),
+                team_id=team_id,
+            )
+            db.add(new_team_invite)
+            return new_team_invite.id
 
-        db.add(new_team_invite)
-        db.commit()
-        return new_team_invite.id
+        return self.__commit_with_new_ids(db, add_invite)
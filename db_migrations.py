@@ -0,0 +1,43 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from db_session import Base
+
+
+def add_missing_columns(engine: Engine) -> None:
+    # new columns have to be nullable or declare a server_default to be added to existing rows
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            ddl = f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} " \
+                  f"{column.type.compile(engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            with engine.begin() as connection:
+                connection.execute(text(ddl))
+
+
+def create_missing_indexes(engine: Engine) -> None:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+# create_all only creates missing tables, changes to existing tables are applied here
+migrations = [
+    add_missing_columns,
+    create_missing_indexes,
+]
+
+
+def run_migrations(engine: Engine) -> None:
+    for migration in migrations:
+        migration(engine)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, String, DateTime, Boolean
+from sqlalchemy import Column, ForeignKey, String, DateTime, Boolean, Integer, Index
 from sqlalchemy.orm import relationship
 
 from db_session import Base
@@ -18,6 +18,10 @@ class User(Base):
 
 class Session(Base):
     __tablename__ = "Session"
+    __table_args__ = (
+        Index("ix_Session_user_id_expiration_date", "user_id", "expiration_date"),
+        Index("ix_Session_expiration_date", "expiration_date"),
+    )
 
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("User.id"), nullable=False)
@@ -27,6 +31,10 @@ class Session(Base):
 
 class Event(Base):
     __tablename__ = "Event"
+    __table_args__ = (
+        Index("ix_Event_start_point_end_point", "start_point", "end_point"),
+        Index("ix_Event_end_point", "end_point"),
+    )
 
     id = Column(String, primary_key=True, index=True)
     title = Column(String, nullable=False)
@@ -34,6 +42,10 @@ class Event(Base):
     start_point = Column(DateTime, nullable=False)
     end_point = Column(DateTime, nullable=False)
     priority_id = Column(String, ForeignKey("EventPriority.id"), nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # RRULE-like rule, the row holds the first occurrence and recurrence_end bounds the series for window queries
+    recurrence = Column(String)
+    recurrence_end = Column(DateTime)
     users = relationship("UserEvent", back_populates="event")
     teams = relationship("TeamEvent", back_populates="event", cascade="all, delete-orphan")
     priority = relationship("EventPriority", back_populates="events")
@@ -53,7 +65,7 @@ class UserEvent(Base):
     __tablename__ = "UserEvent"
 
     user_id = Column(String, ForeignKey("User.id"), primary_key=True)
-    event_id = Column(String, ForeignKey("Event.id"), primary_key=True)
+    event_id = Column(String, ForeignKey("Event.id"), primary_key=True, index=True)
     user = relationship("User", back_populates="events")
     event = relationship("Event", back_populates="users")
 
@@ -65,6 +77,8 @@ class Org(Base):
     name = Column(String, nullable=False)
     owner_id = Column(String, ForeignKey("User.id"))
     owner_datetime = Column(DateTime)
+    revision = Column(Integer, nullable=False, default=0, server_default="0")
+    modified_at = Column(DateTime)
     users = relationship("UserOrg", back_populates="org")
     teams = relationship("Team", back_populates="org")
     codes = relationship("OrgCode", back_populates="org")
@@ -74,7 +88,7 @@ class Team(Base):
     __tablename__ = "Team"
 
     id = Column(String, primary_key=True, index=True)
-    org_id = Column(String, ForeignKey("Org.id"), nullable=False)
+    org_id = Column(String, ForeignKey("Org.id"), nullable=False, index=True)
     name = Column(String, nullable=False)
     owner_id = Column(String, ForeignKey("User.id"))
     owner_datetime = Column(DateTime, nullable=False)
@@ -89,7 +103,7 @@ class UserTeam(Base):
     __tablename__ = "UserTeam"
 
     user_id = Column(String, ForeignKey("User.id"), primary_key=True)
-    team_id = Column(String, ForeignKey("Team.id", ondelete="CASCADE"), primary_key=True)
+    team_id = Column(String, ForeignKey("Team.id", ondelete="CASCADE"), primary_key=True, index=True)
     is_admin = Column(Boolean, nullable=False, default=False)
     user = relationship("User", back_populates="teams")
     team = relationship("Team", back_populates="users")
@@ -100,7 +114,7 @@ class UserOrg(Base):
     __tablename__ = "UserOrg"
 
     user_id = Column(String, ForeignKey("User.id"), primary_key=True)
-    org_id = Column(String, ForeignKey("Org.id"), primary_key=True)
+    org_id = Column(String, ForeignKey("Org.id"), primary_key=True, index=True)
     entry_date_time = Column(DateTime, nullable=False)
     user = relationship("User", back_populates="orgs")
     org = relationship("Org", back_populates="users")
@@ -110,7 +124,7 @@ class TeamEvent(Base):
     __tablename__ = "TeamEvent"
 
     team_id = Column(String, ForeignKey("Team.id", ondelete="CASCADE"), primary_key=True)
-    event_id = Column(String, ForeignKey("Event.id"), primary_key=True)
+    event_id = Column(String, ForeignKey("Event.id"), primary_key=True, index=True)
     team = relationship("Team", back_populates="events")
     event = relationship("Event", back_populates="teams", cascade="all, delete-orphan", single_parent=True)
 
@@ -120,7 +134,7 @@ class TeamInvite(Base):
 
     id = Column(String, primary_key=True, index=True)
     create_date_time = Column(DateTime, nullable=False)
-    team_id = Column(String, ForeignKey("Team.id", ondelete="CASCADE"), nullable=False)
+    team_id = Column(String, ForeignKey("Team.id", ondelete="CASCADE"), nullable=False, index=True)
     used = Column(Boolean, nullable=False, default=False)
     team = relationship("Team", back_populates="invites")
 
@@ -132,4 +146,6 @@ class OrgCode(Base):
     create_date_time = Column(DateTime, nullable=False)
     org_id = Column(String, ForeignKey("Org.id"), nullable=False)
     valid = Column(Boolean, nullable=False, default=True)
+    # set by the maintenance task when it first finds the code invalid, the code is purged after the retention period
+    invalidated_at = Column(DateTime)
     org = relationship("Org", back_populates="codes")
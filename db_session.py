@@ -1,16 +1,119 @@
 import os
+import threading
+import time
+import sqlalchemy.exc
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 load_dotenv()
 
+
+def env_flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() in ("1", "true", "yes", "on")
+
+
 SQLALCHEMY_DATABASE_URL = os.environ.get("SQLALCHEMY_DATABASE_URL")
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", "true")
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", "0"))
+DB_PREPARE_THRESHOLD = os.environ.get("DB_PREPARE_THRESHOLD")
+
+
+class PoolStatistics:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connect_errors = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float) -> None:
+        with self.__lock:
+            self.checkouts += 1
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def record_timeout(self) -> None:
+        with self.__lock:
+            self.timeouts += 1
+
+    def record_connect_error(self) -> None:
+        with self.__lock:
+            self.connect_errors += 1
+
+
+pool_statistics = PoolStatistics()
+
+
+class TimedQueuePool(QueuePool):
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except sqlalchemy.exc.TimeoutError:
+            pool_statistics.record_timeout()
+            raise
+        except Exception:
+            # e.g. refused connections, failed authentication or unresolvable hosts of new connections
+            pool_statistics.record_connect_error()
+            raise
+        pool_statistics.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+def build_engine(database_url: str):
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        return create_engine(database_url, pool_pre_ping=DB_POOL_PRE_PING)
+
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    # server-side prepared statements are only available with the psycopg 3 driver
+    if DB_PREPARE_THRESHOLD is not None and url.get_driver_name() == "psycopg":
+        connect_args["prepare_threshold"] = int(DB_PREPARE_THRESHOLD) if DB_PREPARE_THRESHOLD else None
+
+    return create_engine(
+        database_url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
+
+
+def get_pool_status() -> dict:
+    pool = engine.pool
+    status = {
+        "checkouts": pool_statistics.checkouts,
+        "timeouts": pool_statistics.timeouts,
+        "connect_errors": pool_statistics.connect_errors,
+        "total_wait_seconds": pool_statistics.total_wait_seconds,
+        "max_wait_seconds": pool_statistics.max_wait_seconds,
+    }
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    return status
@@ -0,0 +1,33 @@
+import os
+from typing import Optional, Hashable
+
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", "1000"))
+FRAGMENT_CACHE_TTL_SECONDS = float(os.environ.get("FRAGMENT_CACHE_TTL_SECONDS", "30"))
+
+
+class FragmentCache:
+    # Rendered pages grouped by organization, so that a membership change drops every page of that organization.
+    # Invalidation only reaches the local worker, other workers pick the change up after ttl_seconds
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.__pages = TTLCache(max_size, ttl_seconds)
+
+    def get(self, org_id: str, key: Hashable) -> Optional[bytes]:
+        return self.__pages.get((org_id, key))
+
+    def put(self, org_id: str, key: Hashable, content: bytes) -> None:
+        self.__pages.put((org_id, key), content)
+
+    def invalidate(self, org_id: str) -> None:
+        self.__pages.invalidate_where(lambda page_key: page_key[0] == org_id)
+
+    def clear(self) -> None:
+        self.__pages.clear()
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL_SECONDS)
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from typing import Tuple
+
+import numpy as np
+
+
+def to_slot_indexes(points: list, start: datetime, slot: timedelta, round_up: bool) -> np.ndarray:
+    offsets = np.array(points, dtype="datetime64[s]") - np.datetime64(start, "s")
+    slot_length = np.timedelta64(int(slot.total_seconds()), "s")
+    if round_up:
+        return -(-offsets // slot_length)
+    return offsets // slot_length
+
+
+def merge_intervals(keys: np.ndarray, starts: np.ndarray, ends: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # overlapping intervals with the same key become one, starts and ends have to be non-negative slot indexes
+    if not len(keys):
+        return keys, starts, ends
+    order = np.lexsort((starts, keys))
+    keys, starts, ends = keys[order], starts[order], ends[order]
+    # the key offset keeps the running maximum from reaching into the next key
+    span = int(max(starts.max(), ends.max())) + 1
+    reached = np.maximum.accumulate(keys * span + ends)
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] * span + starts[1:] > reached[:-1]
+    group_starts = np.flatnonzero(first)
+    return keys[group_starts], starts[group_starts], np.maximum.reduceat(ends, group_starts)
+
+
+def build_heatmap(member_indexes: np.ndarray, priority_indexes: np.ndarray, start_slots: np.ndarray,
+                  end_slots: np.ndarray, membership_teams: np.ndarray, membership_members: np.ndarray,
+                  team_count: int, priority_count: int, slot_count: int) -> np.ndarray:
+    # [team, priority, slot] counts of members with an event running in the slot, overlapping events of one member
+    # are merged first so that they count once; memory grows with the events and the result, not with the members
+    start_slots = np.clip(start_slots, 0, slot_count)
+    end_slots = np.clip(end_slots, 0, slot_count)
+    running = start_slots < end_slots
+    keys, start_slots, end_slots = merge_intervals(
+        member_indexes[running] * priority_count + priority_indexes[running], start_slots[running], end_slots[running])
+    member_indexes, priority_indexes = np.divmod(keys, priority_count)
+
+    # every merged interval is counted once for each team of its member
+    order = np.argsort(membership_members, kind="stable")
+    membership_teams, membership_members = membership_teams[order], membership_members[order]
+    member_count = int(max(membership_members.max(initial=-1), member_indexes.max(initial=-1))) + 1
+    team_counts = np.bincount(membership_members, minlength=member_count)
+    first_memberships = np.cumsum(team_counts) - team_counts
+    repeats = team_counts[member_indexes]
+    intervals = np.repeat(np.arange(len(member_indexes)), repeats)
+    positions = np.arange(len(intervals)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    teams = membership_teams[first_memberships[member_indexes][intervals] + positions]
+
+    shape = (team_count, priority_count, slot_count + 1)
+    size = team_count * priority_count * (slot_count + 1)
+    rows = (teams, priority_indexes[intervals])
+    differences = np.bincount(np.ravel_multi_index(rows + (start_slots[intervals],), shape), minlength=size) - \
+        np.bincount(np.ravel_multi_index(rows + (end_slots[intervals],), shape), minlength=size)
+    return np.cumsum(differences.reshape(shape), axis=2)[:, :, :slot_count].astype(np.int32)
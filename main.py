@@ -1,24 +1,53 @@
+import asyncio
+import hmac
+import json
+import os
+import time
 import uvicorn
-from typing import Any
-from fastapi import FastAPI, Request, Response, HTTPException, Depends, Cookie
-from fastapi.responses import RedirectResponse, JSONResponse
+from datetime import datetime, timedelta
+from typing import Any, Optional
+from fastapi import FastAPI, Request, Response, HTTPException, Depends, Cookie, Header, Query
+from fastapi.responses import RedirectResponse, JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session as DBSession
 
 import db_event_listener
 import db_models
+from auth_context import get_auth_context
 from db_handler import DBHandler, get_db
-from db_session import engine
+from db_migrations import run_migrations
+from calendar_broker import calendar_broker, CALENDAR_STREAM_KEEPALIVE_SECONDS
+from db_session import engine, get_pool_status, SessionLocal
+from fragment_cache import fragment_cache
+from maintenance import run_maintenance_periodically, MAINTENANCE_INTERVAL_MINUTES
+from metrics import metrics_registry, METRICS_TOKEN
 from schemas import LoginCredentials, RegistrationCredentials, OrganizationCreateSchema, TeamNameSchema, \
-    PostOrgCalendarSchema, ChangeTeamRoleSchema, UserIdSchema
-from utils import hash_password, verify_password
+    PostOrgCalendarSchema, ChangeTeamRoleSchema, UserIdSchema, PostCalendarChangesSchema
+from password_service import password_service
+from recurrence import MAX_EXPANSION_WINDOW, RECURRENCE_MAX_WINDOW_DAYS
+from request_timing import RequestTimingMiddleware, TimedTemplate
+from sql_stats import QueryStatsMiddleware
+from utils import compute_etag, etag_matches, hash_files, to_http_date, to_naive_utc, add_months, join_chunks
 
 app = FastAPI()
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(RequestTimingMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 db_handler = DBHandler()
 db_models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 templates = Jinja2Templates(directory="templates")
+templates.env.template_class = TimedTemplate
+HEATMAP_SPANS = {
+    "week": lambda start: start + timedelta(days=7),
+    "month": lambda start: add_months(start, 1),
+}
+CALENDAR_STREAM_CHUNK_SIZE = 64 * 1024
+# part of every ETag so that a deploy with changed code, templates or static files revalidates, it has to be the
+# same in every worker of a deploy: BUILD_ID, e.g. the git revision, or else a hash of the deployed files
+BUILD_ID = os.environ.get("BUILD_ID") or hash_files(["*.py", "templates/**", "static/**"])
 
 
 def dynamic_url_for(request: Request, name: str, **path_params: Any) -> str:
@@ -31,6 +60,63 @@ def dynamic_url_for(request: Request, name: str, **path_params: Any) -> str:
 templates.env.globals["dynamic_url_for"] = dynamic_url_for
 
 
+@app.on_event("startup")
+async def start_maintenance():
+    # a non-positive interval disables the in-process task, e.g. when maintenance.py runs as a cron job
+    if MAINTENANCE_INTERVAL_MINUTES > 0:
+        app.state.maintenance_task = asyncio.create_task(run_maintenance_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_maintenance():
+    maintenance_task = getattr(app.state, "maintenance_task", None)
+    if maintenance_task is not None:
+        maintenance_task.cancel()
+
+
+def get_revision_headers(db: DBSession, org_id, user_id, *variant) -> dict:
+    return build_revision_headers(db_handler.get_org_revision(db, org_id), org_id, user_id, *variant)
+
+
+def build_revision_headers(revision, org_id, user_id, *variant) -> dict:
+    if revision is None:
+        return {}
+
+    revision_number, modified_at = revision
+    etag_source = ":".join(str(part) for part in (BUILD_ID, org_id, revision_number, user_id, *variant))
+    headers = {
+        "ETag": compute_etag(etag_source.encode()),
+        "Cache-Control": "private, no-cache",
+    }
+    if modified_at is not None:
+        headers["Last-Modified"] = to_http_date(modified_at)
+    return headers
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    # only the ETag is compared: If-Modified-Since has a resolution of one second, two writes within the same second
+    # would be answered with a stale 304
+    return bool(headers) and etag_matches(request.headers.get("if-none-match"), headers["ETag"])
+
+
+def check_event_window(start: Optional[datetime], end: Optional[datetime]) -> None:
+    # recurring events are expanded for every occurrence in the window
+    if start is not None and end is not None and to_naive_utc(end) - to_naive_utc(start) > MAX_EXPANSION_WINDOW:
+        raise HTTPException(status_code=422, detail=f'The range may span at most {RECURRENCE_MAX_WINDOW_DAYS} days')
+
+
+def render_cached_page(request: Request, org_id, revision, template_name: str, key: tuple, headers: dict,
+                       build_context):
+    # static urls in the pages depend on the requested host; with the revision in the key a page rendered before a
+    # write is never served after it, neither in another worker nor when it was stored after the invalidation
+    cache_key = (template_name, str(request.base_url), revision and revision[0]) + key
+    content = fragment_cache.get(org_id, cache_key)
+    if content is None:
+        content = templates.TemplateResponse(template_name, build_context()).body
+        fragment_cache.put(org_id, cache_key, content)
+    return HTMLResponse(content=content, headers=headers)
+
+
 @app.exception_handler(HTTPException)
 async def exc_handle(request: Request, exc: HTTPException):
     if (request.method == 'GET') and (exc.status_code == 403):
@@ -53,7 +139,7 @@ async def exc_handle(request: Request, exc: HTTPException):
 
 @app.get("/")
 @app.get('/home')
-async def get_home(request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_home(request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     organizations = db_handler.get_user_organizations(db, user_id)
     return templates.TemplateResponse("home.html", {
@@ -65,39 +151,171 @@ async def get_home(request: Request, token: str = Cookie(None), db: DBSession =
 
 
 @app.get('/org/{org_id}/calendar')
-async def get_calendar_detail(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_calendar_detail(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
 
+    headers = get_revision_headers(db, org_id, user_id, "calendar")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
     return templates.TemplateResponse("calendar_detail.html", {
         "request": request,
         "org_id": org_id,
         "org_name": db_handler.get_org_name_by_id(db, org_id),
         "user_id": user_id,
-        "calendar": db_handler.get_org_calendar_details(user_id, org_id, db),
-    })
+        "calendar": db_handler.get_org_calendar_details(user_id, org_id, db, include_events=False),
+    }, headers=headers)
+
+
+@app.get('/org/{org_id}/calendar/events')
+def get_calendar_events(org_id, start: datetime, end: datetime, request: Request, token: str = Cookie(None),
+                        db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    if not db_handler.is_user_member_of_org(db, user_id, org_id):
+        raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+    check_event_window(start, end)
+
+    headers = get_revision_headers(db, org_id, user_id, "calendar-events", start.isoformat(), end.isoformat())
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    calendar_events = db_handler.get_org_calendar_events(user_id, org_id, start, end, db)
+    content = json.dumps(calendar_events, separators=(',', ':')).encode()
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+@app.get('/org/{org_id}/calendar/data')
+def get_calendar_data(org_id, request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      token: str = Cookie(None), db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    if not db_handler.is_user_member_of_org(db, user_id, org_id):
+        raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+    check_event_window(start, end)
+
+    headers = get_revision_headers(db, org_id, user_id, "calendar-data", start and start.isoformat(),
+                                   end and end.isoformat())
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    calendar_data = db_handler.get_org_calendar_data(user_id, org_id, db, start, end)
+    content = json.dumps(calendar_data, separators=(',', ':')).encode()
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def stream_org_calendar(user_id, org_id, start: Optional[datetime], end: Optional[datetime]):
+    # the session lives as long as the response is streamed and is closed when the client goes away
+    db = SessionLocal()
+    try:
+        yield from join_chunks(db_handler.iter_org_calendar_json(user_id, org_id, db, start, end),
+                               CALENDAR_STREAM_CHUNK_SIZE)
+    finally:
+        db.close()
+
+
+@app.get('/org/{org_id}/calendar/teams')
+def get_calendar_teams(org_id, request: Request, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       token: str = Cookie(None)):
+    # OrgCalendarSchema as a stream, the request-scoped session would otherwise stay open until the stream ends
+    db = SessionLocal()
+    try:
+        user_id = db_handler.verify_user_session(db, token)
+        if not db_handler.is_user_member_of_org(db, user_id, org_id):
+            raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+        check_event_window(start, end)
+        headers = get_revision_headers(db, org_id, user_id, "calendar-teams", start and start.isoformat(),
+                                       end and end.isoformat())
+    finally:
+        db.close()
+
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(stream_org_calendar(user_id, org_id, start, end), media_type="application/json",
+                             headers=headers)
+
+
+def authorize_org_member(org_id, token: str) -> str:
+    # for long-lived responses, which must not hold on to a pooled connection like a get_db session would
+    db = SessionLocal()
+    try:
+        user_id = db_handler.verify_user_session(db, token)
+        if not db_handler.is_user_member_of_org(db, user_id, org_id):
+            raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+        return user_id
+    finally:
+        db.close()
+
+
+@app.get('/org/{org_id}/calendar/stream')
+async def get_calendar_stream(org_id, request: Request, token: str = Cookie(None)):
+    await run_in_threadpool(authorize_org_member, org_id, token)
+
+    async def event_stream():
+        authorized_at = time.monotonic()
+        async for message in calendar_broker.subscribe(org_id, CALENDAR_STREAM_KEEPALIVE_SECONDS):
+            if await request.is_disconnected():
+                break
+            # an ended session or a lost membership closes the stream, checked once per keepalive interval also while
+            # changes keep arriving
+            if time.monotonic() - authorized_at >= CALENDAR_STREAM_KEEPALIVE_SECONDS:
+                try:
+                    await run_in_threadpool(authorize_org_member, org_id, token)
+                except HTTPException:
+                    break
+                authorized_at = time.monotonic()
+            yield ": keepalive\n\n" if message is None else f"data: {message}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get('/org/{org_id}/calendar/heatmap')
+def get_calendar_heatmap(org_id, start: datetime, request: Request, response: Response, span: str = "week",
+                         slot_minutes: int = 30, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    if not db_handler.is_user_member_of_org(db, user_id, org_id):
+        raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+    if span not in HEATMAP_SPANS or not 5 <= slot_minutes <= 24 * 60:
+        raise HTTPException(status_code=422, detail='Unsupported heatmap span or slot length')
+
+    headers = get_revision_headers(db, org_id, user_id, "heatmap", start.isoformat(), span, slot_minutes)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return db_handler.get_org_heatmap(db, org_id, start, HEATMAP_SPANS[span](start),
+                                      timedelta(minutes=slot_minutes))
 
 
 @app.post('/org/{org_id}/calendar')
-async def post_calendar_details(org_id, calendar_details: PostOrgCalendarSchema, token: str = Cookie(None),
-                                db: DBSession = Depends(get_db)):
+def post_calendar_details(org_id, calendar_details: PostOrgCalendarSchema, token: str = Cookie(None),
+                          x_calendar_client: Optional[str] = Header(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
+    db.info["calendar_client_id"] = x_calendar_client
+    check_event_window(calendar_details.start, calendar_details.end)
     if user_id == calendar_details.memberEvents.user_id:
-        db_handler.update_events_for_user(user_id, calendar_details.memberEvents.events, db)
+        db_handler.update_org_calendar(user_id, org_id, calendar_details, db)
     else:
         raise HTTPException(status_code=403, detail='You are not allowed to modify events from the provided user')
 
-    for team in calendar_details.teamsEvents:
-        db_handler.update_events_for_team(user_id, org_id, team.team_id, team.events, db)
+    return {}
 
-    db_handler.delete_unused_events(db)
 
-    return {}
+@app.post('/org/{org_id}/calendar/changes')
+def post_calendar_changes(org_id, changes: PostCalendarChangesSchema, token: str = Cookie(None),
+                          x_calendar_client: Optional[str] = Header(None), db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    db.info["calendar_client_id"] = x_calendar_client
+    if not db_handler.is_user_member_of_org(db, user_id, org_id):
+        raise HTTPException(status_code=403, detail='You are not a member of the organization you want to modify')
+
+    return db_handler.apply_calendar_changes(user_id, org_id, changes, db)
 
 
 @app.get('/org/{org_id}/team-creation')
-async def get_team_creation(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_team_creation(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
@@ -111,8 +329,8 @@ async def get_team_creation(org_id, request: Request, token: str = Cookie(None),
 
 
 @app.post('/org/{org_id}/team-creation')
-async def post_team_creation(request: TeamNameSchema, org_id, token: str = Cookie(None),
-                             db: DBSession = Depends(get_db)):
+def post_team_creation(request: TeamNameSchema, org_id, token: str = Cookie(None),
+                       db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not eligible to create a team because you are not a '
@@ -129,7 +347,7 @@ async def post_team_creation(request: TeamNameSchema, org_id, token: str = Cooki
 
 
 @app.post('/org/{org_id}/team/{team_id}/join-team')
-async def join_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def join_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not eligible to join a team because you are not a member '
@@ -144,7 +362,7 @@ async def join_team(org_id, team_id, token: str = Cookie(None), db: DBSession =
 
 
 @app.post('/org/{org_id}/team/{team_id}/leave-team')
-async def leave_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def leave_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not eligible to leave a team because you are not a '
@@ -159,12 +377,18 @@ async def leave_team(org_id, team_id, token: str = Cookie(None), db: DBSession =
 
 
 @app.get('/org/{org_id}')
-async def get_org(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_org(org_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
 
-    return templates.TemplateResponse("org.html", {
+    revision = db_handler.get_org_revision(db, org_id)
+    headers = build_revision_headers(revision, org_id, user_id, "org")
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    # the organization page looks the same for every member of the organization
+    return render_cached_page(request, org_id, revision, "org.html", ("member",), headers, lambda: {
         "request": request,
         "org_id": org_id,
         "org_name": db_handler.get_org_name_by_id(db, org_id),
@@ -174,12 +398,18 @@ async def get_org(org_id, request: Request, token: str = Cookie(None), db: DBSes
 
 
 @app.get('/org/{org_id}/team/{team_id}')
-async def get_team(org_id, team_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_team(org_id, team_id, request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
 
-    return templates.TemplateResponse("team.html", {
+    revision = db_handler.get_org_revision(db, org_id)
+    headers = build_revision_headers(revision, org_id, user_id, "team", team_id)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    viewer_role = get_auth_context(db, user_id).team_role(team_id)
+    return render_cached_page(request, org_id, revision, "team.html", (team_id, viewer_role), headers, lambda: {
         "request": request,
         "org_id": org_id,
         "org_name": db_handler.get_org_name_by_id(db, org_id),
@@ -190,11 +420,17 @@ async def get_team(org_id, team_id, request: Request, token: str = Cookie(None),
 
 
 @app.get('/org/{org_id}/team/{team_id}/team-members')
-async def get_team_members(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_team_members(org_id, team_id, request: Request, response: Response, token: str = Cookie(None),
+                     db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     if not db_handler.is_user_member_of_org(db, user_id, org_id):
         raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
 
+    headers = get_revision_headers(db, org_id, user_id, "team-members", team_id)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
     team_members = db_handler.get_team_members(db, org_id, team_id)
 
     return {
@@ -203,9 +439,31 @@ async def get_team_members(org_id, team_id, token: str = Cookie(None), db: DBSes
     }
 
 
+@app.get('/org/{org_id}/team/{team_id}/availability')
+def get_team_availability(org_id, team_id, start: datetime, end: datetime, request: Request, response: Response,
+                          min_duration: int = Query(60, ge=1), limit: int = Query(10, ge=1),
+                          token: str = Cookie(None), db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    if not db_handler.is_user_member_of_org(db, user_id, org_id):
+        raise HTTPException(status_code=403, detail='You are not a member of the organization you want to visit')
+    # one bound with and one without an offset must not fail the comparison
+    start, end = to_naive_utc(start), to_naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=422, detail='The end of the range has to be after its start')
+    check_event_window(start, end)
+
+    headers = get_revision_headers(db, org_id, user_id, "availability", team_id, start.isoformat(), end.isoformat(),
+                                   min_duration, limit)
+    if is_not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return db_handler.get_team_availability(db, org_id, team_id, start, end, timedelta(minutes=min_duration), limit)
+
+
 @app.post('/org/{org_id}/team/{team_id}/change-team-role')
-async def change_team_role(org_id, team_id, schema: ChangeTeamRoleSchema, token: str = Cookie(None),
-                           db: DBSession = Depends(get_db)):
+def change_team_role(org_id, team_id, schema: ChangeTeamRoleSchema, token: str = Cookie(None),
+                     db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
 
     db_handler.change_team_role(db, org_id, team_id, user_id, schema)
@@ -224,9 +482,11 @@ async def get_login(request: Request):
 
 @app.post("/login")
 async def post_login(credentials: LoginCredentials, db: DBSession = Depends(get_db)):
-    user_id, hashed_password = db_handler.get_user_id_and_password(db, credentials.username)
-    if user_id != '' and hashed_password != '' and verify_password(credentials.password, hashed_password):
-        token = db_handler.update_session(db, user_id)
+    user_id, hashed_password = await run_in_threadpool(db_handler.get_user_id_and_password, db,
+                                                       credentials.username)
+    if user_id != '' and hashed_password != '' and \
+            await password_service.verify_password(credentials.password, hashed_password):
+        token = await run_in_threadpool(db_handler.update_session, db, user_id)
         return {
             "message": "Login successful",
             "token": token,
@@ -236,7 +496,7 @@ async def post_login(credentials: LoginCredentials, db: DBSession = Depends(get_
 
 
 @app.post("/logout")
-async def logout(response: Response, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def logout(response: Response, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     db_handler.end_session(db, token)
     response.delete_cookie(key='token')
     return {'message': 'Logged out successfully'}
@@ -249,8 +509,8 @@ async def get_signup(request: Request):
 
 @app.post("/signup")
 async def post_register(credentials: RegistrationCredentials, db: DBSession = Depends(get_db)):
-    credentials.password = hash_password(credentials.password)
-    user_id = db_handler.create_user(credentials, db)
+    credentials.password = await password_service.hash_password(credentials.password)
+    user_id = await run_in_threadpool(db_handler.create_user, credentials, db)
     return {
         "message": "Registration successful",
         "user_id": user_id,
@@ -258,7 +518,7 @@ async def post_register(credentials: RegistrationCredentials, db: DBSession = De
 
 
 @app.get("/admin")
-async def get_admin_panel(request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_admin_panel(request: Request, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     username = db_handler.get_username_by_id(user_id, db)
     if username == 'Admin':
@@ -267,8 +527,29 @@ async def get_admin_panel(request: Request, token: str = Cookie(None), db: DBSes
         raise HTTPException(status_code=403, detail='Only the admin can access this route')
 
 
+@app.get("/admin/metrics")
+def get_admin_metrics(token: str = Cookie(None), db: DBSession = Depends(get_db)):
+    user_id = db_handler.verify_user_session(db, token)
+    username = db_handler.get_username_by_id(user_id, db)
+    if username == 'Admin':
+        return {
+            "password_hashing": password_service.get_metrics(),
+            "db_pool": get_pool_status(),
+        }
+    else:
+        raise HTTPException(status_code=403, detail='Only the admin can access this route')
+
+
+@app.get("/metrics")
+def get_metrics(authorization: Optional[str] = Header(None)):
+    if not METRICS_TOKEN or not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail='Missing or invalid metrics token')
+
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/join-org/{org_code}")
-async def join_org(org_code, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def join_org(org_code, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     db_handler.use_org_code(user_id, org_code, db)
     return {
@@ -277,7 +558,7 @@ async def join_org(org_code, token: str = Cookie(None), db: DBSession = Depends(
 
 
 @app.post("/org-creation")
-async def post_org(request: OrganizationCreateSchema, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def post_org(request: OrganizationCreateSchema, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     username = db_handler.get_username_by_id(user_id, db)
     if username == 'Admin':
@@ -291,7 +572,7 @@ async def post_org(request: OrganizationCreateSchema, token: str = Cookie(None),
 
 
 @app.get("/invite/{invite_id}")
-async def get_invite(invite_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def get_invite(invite_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     org_id, team_id = db_handler.use_invite(db, invite_id, user_id)
     redirect_url = f"/org/{org_id}/team/{team_id}"
@@ -300,7 +581,7 @@ async def get_invite(invite_id, token: str = Cookie(None), db: DBSession = Depen
 
 
 @app.post('/org/{org_id}/team/{team_id}/generate-invite')
-async def generate_invite(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def generate_invite(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     invite_id = db_handler.generate_invite(db, org_id, team_id, user_id)
 
@@ -310,7 +591,7 @@ async def generate_invite(org_id, team_id, token: str = Cookie(None), db: DBSess
 
 
 @app.post('/org/{org_id}/team/{team_id}/delete-team')
-async def delete_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
+def delete_team(org_id, team_id, token: str = Cookie(None), db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     db_handler.delete_team(db, org_id, team_id, user_id)
 
@@ -320,8 +601,8 @@ async def delete_team(org_id, team_id, token: str = Cookie(None), db: DBSession
 
 
 @app.post('/org/{org_id}/team/{team_id}/rename-team')
-async def rename_team(request: TeamNameSchema, org_id, team_id, token: str = Cookie(None),
-                      db: DBSession = Depends(get_db)):
+def rename_team(request: TeamNameSchema, org_id, team_id, token: str = Cookie(None),
+                db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     db_handler.rename_team(db, org_id, team_id, user_id, request.team_name)
 
@@ -331,8 +612,8 @@ async def rename_team(request: TeamNameSchema, org_id, team_id, token: str = Coo
 
 
 @app.post('/org/{org_id}/team/{team_id}/remove-member')
-async def remove_user(request: UserIdSchema, org_id, team_id, token: str = Cookie(None),
-                      db: DBSession = Depends(get_db)):
+def remove_user(request: UserIdSchema, org_id, team_id, token: str = Cookie(None),
+                db: DBSession = Depends(get_db)):
     user_id = db_handler.verify_user_session(db, token)
     db_handler.remove_member_from_team(db, org_id, team_id, user_id, request.user_id)
 
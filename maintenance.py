@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import exists, or_
+from sqlalchemy.orm import Session as DBSession
+from starlette.concurrency import run_in_threadpool
+
+from db_handler import INVITE_VALID_DURATION
+from db_models import Session, TeamInvite, OrgCode, Event, UserEvent, TeamEvent
+from db_session import SessionLocal
+
+load_dotenv()
+
+MAINTENANCE_INTERVAL_MINUTES = float(os.environ.get("MAINTENANCE_INTERVAL_MINUTES", "60"))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get("MAINTENANCE_BATCH_SIZE", "1000"))
+# used or expired invites and invalid organization codes are kept a while,
+# so visitors still get "no longer valid" instead of "does not exist"
+INVITE_RETENTION_DAYS = int(os.environ.get("INVITE_RETENTION_DAYS", "7"))
+
+logger = logging.getLogger(__name__)
+
+
+def delete_in_batches(db: DBSession, table, *conditions, batch_size: int) -> int:
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.query(table.id).filter(*conditions).limit(batch_size)]
+        if not ids:
+            return deleted
+        db.query(table).filter(table.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+
+def update_in_batches(db: DBSession, table, values: dict, *conditions, batch_size: int) -> int:
+    # the values must take the rows out of the conditions, or the same rows are found again
+    updated = 0
+    while True:
+        ids = [row.id for row in db.query(table.id).filter(*conditions).limit(batch_size)]
+        if not ids:
+            return updated
+        db.query(table).filter(table.id.in_(ids)).update(values, synchronize_session=False)
+        db.commit()
+        updated += len(ids)
+        if len(ids) < batch_size:
+            return updated
+
+
+def delete_expired_sessions(db: DBSession, now: datetime, batch_size: int) -> int:
+    return delete_in_batches(db, Session, Session.expiration_date <= now, batch_size=batch_size)
+
+
+def delete_stale_invites(db: DBSession, now: datetime, batch_size: int) -> int:
+    retention = timedelta(days=INVITE_RETENTION_DAYS)
+    return delete_in_batches(db, TeamInvite,
+                             or_(TeamInvite.used.is_(True),
+                                 TeamInvite.create_date_time < now - INVITE_VALID_DURATION),
+                             TeamInvite.create_date_time < now - INVITE_VALID_DURATION - retention,
+                             batch_size=batch_size)
+
+
+def delete_invalid_org_codes(db: DBSession, now: datetime, batch_size: int) -> int:
+    # codes are invalidated without a timestamp, the retention starts with the first run that finds them invalid
+    update_in_batches(db, OrgCode, {OrgCode.invalidated_at: now},
+                      OrgCode.valid.is_(False),
+                      OrgCode.invalidated_at.is_(None),
+                      batch_size=batch_size)
+    retention = timedelta(days=INVITE_RETENTION_DAYS)
+    return delete_in_batches(db, OrgCode,
+                             OrgCode.valid.is_(False),
+                             OrgCode.invalidated_at < now - retention,
+                             batch_size=batch_size)
+
+
+def delete_orphaned_events(db: DBSession, batch_size: int) -> int:
+    return delete_in_batches(db, Event,
+                             ~exists().where(UserEvent.event_id == Event.id),
+                             ~exists().where(TeamEvent.event_id == Event.id),
+                             batch_size=batch_size)
+
+
+def run_maintenance(batch_size: int = MAINTENANCE_BATCH_SIZE) -> dict:
+    now = datetime.utcnow().replace(tzinfo=None)
+    db = SessionLocal()
+    try:
+        counts = {
+            "expired_sessions": delete_expired_sessions(db, now, batch_size),
+            "stale_invites": delete_stale_invites(db, now, batch_size),
+            "invalid_org_codes": delete_invalid_org_codes(db, now, batch_size),
+            "orphaned_events": delete_orphaned_events(db, batch_size),
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    logger.info("maintenance finished: %s", counts)
+    return counts
+
+
+async def run_maintenance_periodically() -> None:
+    while True:
+        try:
+            await run_in_threadpool(run_maintenance)
+        except Exception:
+            logger.exception("maintenance run failed")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_MINUTES * 60)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Delete expired sessions, stale invites, invalid organization "
+                                                 "codes and orphaned events.")
+    parser.add_argument("--batch-size", type=int, default=MAINTENANCE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    for name, count in run_maintenance(args.batch_size).items():
+        print(f"{name}: {count}")
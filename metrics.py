@@ -0,0 +1,122 @@
+import os
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+from dotenv import load_dotenv
+from starlette.routing import Match
+
+load_dotenv()
+
+# scrapers have to send "Authorization: Bearer <token>", /metrics answers 401 to every request while it is not set
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def route_template(scope) -> str:
+    # path templates keep the label values bounded, unknown paths share one label
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class Metric:
+    # one sample per combination of label values, rendered in the Prometheus text exposition format
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        # counters and gauges keep one number per label values, histograms their bucket counts followed by the sum
+        self._values: Dict[Tuple[str, ...], Union[float, List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{format_labels(self.label_names, label_values)} {value!r}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set_max(self, *label_values: str, value: float) -> None:
+        with self._lock:
+            self._values[label_values] = max(self._values.get(label_values, value), value)
+
+
+class Histogram(Metric):
+    # cumulative buckets as Prometheus expects them, a value equal to a bound falls into that bucket
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = ()):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *label_values: str, value: float) -> None:
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # one count per bucket, one for +Inf, then the sum of all values
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((label_values, list(counts)) for label_values, counts in self._values.items())
+        label_names = self.label_names + ("le",)
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{format_labels(label_names, label_values + (le,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.label_names, label_values)} {counts[-1]!r}"
+            yield f"{self.name}_count{format_labels(self.label_names, label_values)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.__metrics = []
+        self.__lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.__lock:
+            self.__metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.__lock:
+            metrics = list(self.__metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+metrics_registry = MetricsRegistry()
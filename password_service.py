@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from utils import hash_password, verify_password
+
+load_dotenv()
+
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+class PasswordService:
+    # bcrypt releases the GIL, so a small thread pool keeps the event loop free while capping the CPU spent on it
+    def __init__(self, max_workers: int):
+        self.__max_workers = max_workers
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hashing")
+        self.__lock = threading.Lock()
+        self.__queued = 0
+        self.__running = 0
+        self.__completed = 0
+        self.__total_seconds = 0.0
+        self.__max_seconds = 0.0
+
+    def __run(self, func, *args):
+        with self.__lock:
+            self.__queued -= 1
+            self.__running += 1
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            duration = time.perf_counter() - start
+            with self.__lock:
+                self.__running -= 1
+                self.__completed += 1
+                self.__total_seconds += duration
+                self.__max_seconds = max(self.__max_seconds, duration)
+
+    def __discard_cancelled(self, future) -> None:
+        # work cancelled while still queued never reaches __run
+        if future.cancelled():
+            with self.__lock:
+                self.__queued -= 1
+
+    async def __submit(self, func, *args):
+        with self.__lock:
+            self.__queued += 1
+        # a request cancelled while waiting, e.g. by a client that disconnected, cancels the queued work with it
+        future = self.__executor.submit(self.__run, func, *args)
+        future.add_done_callback(self.__discard_cancelled)
+        return await asyncio.wrap_future(future)
+
+    async def hash_password(self, password: str) -> str:
+        return await self.__submit(hash_password, password)
+
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.__submit(verify_password, plain_password, hashed_password)
+
+    def get_metrics(self) -> dict:
+        with self.__lock:
+            return {
+                "max_workers": self.__max_workers,
+                "queue_depth": self.__queued,
+                "running": self.__running,
+                "completed": self.__completed,
+                "total_seconds": self.__total_seconds,
+                "max_seconds": self.__max_seconds,
+                "avg_seconds": self.__total_seconds / self.__completed if self.__completed else 0.0,
+            }
+
+
+password_service = PasswordService(PASSWORD_HASH_WORKERS)
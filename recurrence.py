@@ -0,0 +1,148 @@
+import os
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RECURRENCE_CACHE_SIZE = int(os.environ.get("RECURRENCE_CACHE_SIZE", "10000"))
+# longest window recurring events are expanded for, it bounds the occurrences of a series and the memoized tuples
+RECURRENCE_MAX_WINDOW_DAYS = int(os.environ.get("RECURRENCE_MAX_WINDOW_DAYS", "400"))
+MAX_EXPANSION_WINDOW = timedelta(days=RECURRENCE_MAX_WINDOW_DAYS)
+
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+FREQUENCIES = {"DAILY": timedelta(days=1), "WEEKLY": timedelta(weeks=1)}
+
+
+class RecurrenceRule(NamedTuple):
+    # subset of RFC 5545 RRULE: FREQ=DAILY|WEEKLY;INTERVAL=n;BYDAY=MO,..;COUNT=n;UNTIL=yyyymmddThhmmssZ
+    freq: str
+    interval: int = 1
+    by_day: Tuple[int, ...] = ()
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+
+def parse_rule(rule: str) -> RecurrenceRule:
+    parts = {}
+    for part in rule.upper().split(";"):
+        name, separator, value = part.partition("=")
+        if not separator or name in parts:
+            raise ValueError(f"Invalid recurrence rule part '{part}'")
+        parts[name] = value
+
+    freq = parts.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise ValueError("Recurrence rules need FREQ=DAILY or FREQ=WEEKLY")
+    interval = int(parts.pop("INTERVAL", "1"))
+    count = int(parts["COUNT"]) if "COUNT" in parts else None
+    parts.pop("COUNT", None)
+    until = datetime.strptime(parts.pop("UNTIL").rstrip("Z"), "%Y%m%dT%H%M%S") if "UNTIL" in parts else None
+    by_day = tuple(sorted({WEEKDAYS.index(day) for day in parts.pop("BYDAY").split(",")})) \
+        if "BYDAY" in parts else ()
+    if parts:
+        raise ValueError(f"Unsupported recurrence rule parts: {', '.join(parts)}")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL and COUNT have to be positive")
+    if by_day and freq != "WEEKLY":
+        raise ValueError("BYDAY is only supported for weekly rules")
+    return RecurrenceRule(freq, interval, by_day, count, until)
+
+
+def normalize_rule(rule: Optional[str]) -> Optional[str]:
+    # raises ValueError for rules that cannot be expanded
+    if not rule:
+        return None
+    parse_rule(rule)
+    return rule.upper()
+
+
+class Series:
+    # occurrence (week, j) starts at anchor + week * period + offsets[j], occurrences before start_point are skipped
+    def __init__(self, start_point: datetime, end_point: datetime, rule: RecurrenceRule):
+        self.start_point = start_point
+        self.duration = end_point - start_point
+        self.rule = rule
+        self.period = FREQUENCIES[rule.freq] * rule.interval
+        if rule.by_day:
+            self.anchor = start_point - timedelta(days=start_point.weekday())
+            self.offsets = [timedelta(days=day) for day in rule.by_day]
+        else:
+            self.anchor = start_point
+            self.offsets = [timedelta(0)]
+        self.first_period = [offset for offset in self.offsets if self.anchor + offset >= start_point]
+
+    def ordinal(self, period_index: int, offset: timedelta) -> int:
+        if period_index == 0:
+            return self.first_period.index(offset)
+        return len(self.first_period) + (period_index - 1) * len(self.offsets) + self.offsets.index(offset)
+
+    def start_at(self, ordinal: int) -> datetime:
+        if ordinal < len(self.first_period):
+            return self.anchor + self.first_period[ordinal]
+        period_index, index = divmod(ordinal - len(self.first_period), len(self.offsets))
+        return self.anchor + (period_index + 1) * self.period + self.offsets[index]
+
+    def last_end(self) -> Optional[datetime]:
+        # upper bound of the end of the last occurrence, None for endless series
+        ends = []
+        if self.rule.count is not None:
+            ends.append(self.start_at(self.rule.count - 1) + self.duration)
+        if self.rule.until is not None:
+            ends.append(self.rule.until + self.duration)
+        return min(ends) if ends else None
+
+    def occurrences(self, window_start: datetime, window_end: datetime):
+        # starts at the first period that can overlap the window, so the cost only depends on the window
+        period_index = max(0, (window_start - self.duration - self.anchor - self.offsets[-1]) // self.period)
+        while True:
+            for offset in self.offsets:
+                occurrence_start = self.anchor + period_index * self.period + offset
+                if occurrence_start < self.start_point:
+                    continue
+                if occurrence_start >= window_end or \
+                        (self.rule.until is not None and occurrence_start > self.rule.until) or \
+                        (self.rule.count is not None and self.ordinal(period_index, offset) >= self.rule.count):
+                    return
+                if occurrence_start + self.duration > window_start:
+                    yield occurrence_start, occurrence_start + self.duration
+            period_index += 1
+
+
+def is_occurrence(start_point: datetime, end_point: datetime, rule: str, occurrence_start: datetime,
+                  occurrence_end: datetime) -> bool:
+    # the start of the series counts as well, even when BYDAY leaves out its weekday
+    if occurrence_end - occurrence_start != end_point - start_point:
+        return False
+    if occurrence_start == start_point:
+        return True
+    occurrences = Series(start_point, end_point, parse_rule(rule)).occurrences(
+        occurrence_start - timedelta(seconds=1), occurrence_start + timedelta(seconds=1))
+    return any(start == occurrence_start for start, _ in occurrences)
+
+
+def recurrence_end(start_point: datetime, end_point: datetime, rule: Optional[str]) -> Optional[datetime]:
+    if not rule:
+        return None
+    return Series(start_point, end_point, parse_rule(rule)).last_end()
+
+
+@lru_cache(maxsize=RECURRENCE_CACHE_SIZE)
+def expand_occurrences(start_point: datetime, end_point: datetime, rule: str, window_start: datetime,
+                       window_end: datetime) -> Tuple[Tuple[datetime, datetime], ...]:
+    # memoized per series and window, a refetch of the same calendar range does not expand again
+    return tuple(Series(start_point, end_point, parse_rule(rule)).occurrences(window_start, window_end))
+
+
+def expand_rows(rows, window_start: datetime, window_end: datetime) -> list:
+    # rows are (key, start_point, end_point, value, rule), every occurrence in the window becomes a row without rule
+    expanded = []
+    for key, start_point, end_point, value, rule in rows:
+        if rule:
+            expanded.extend((key, occurrence_start, occurrence_end, value) for occurrence_start, occurrence_end
+                            in expand_occurrences(start_point, end_point, rule, window_start, window_end))
+        else:
+            expanded.append((key, start_point, end_point, value))
+    return expanded
@@ -0,0 +1,133 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+import jinja2
+from dotenv import load_dotenv
+
+from db_session import env_flag
+from metrics import Histogram, metrics_registry, route_template
+
+load_dotenv()
+
+REQUEST_LATENCY_BUCKETS = [float(bound) for bound in os.environ.get(
+    "REQUEST_LATENCY_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",")]
+# adds a Server-Timing header, which browser developer tools show next to the request
+SERVER_TIMING_HEADER = env_flag("SERVER_TIMING_HEADER", "false")
+
+PHASES = ("auth", "db", "schema", "template", "other")
+
+request_duration_seconds = metrics_registry.register(Histogram(
+    "http_request_duration_seconds", "Time from receiving a request until its response was sent.",
+    ("method", "route"), REQUEST_LATENCY_BUCKETS))
+request_phase_seconds = metrics_registry.register(Histogram(
+    "http_request_phase_seconds", "Time a request spent in one phase, nested phases are not counted twice.",
+    ("method", "route", "phase"), REQUEST_LATENCY_BUCKETS))
+
+
+class RequestTimings:
+    # phases are exclusive: time spent in a nested phase is taken off the phase around it,
+    # e.g. the SQL of a session check counts as "db" and not as "auth"
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.__running: List[str] = []
+
+    def enter(self, phase: str) -> None:
+        self.__running.append(phase)
+
+    def exit(self, phase: str, seconds: float) -> None:
+        self.__running.pop()
+        self.record(phase, seconds)
+
+    def record(self, phase: str, seconds: float) -> None:
+        # also used directly for work that was timed elsewhere, like the SQL statements
+        self.seconds[phase] += seconds
+        if self.__running:
+            self.seconds[self.__running[-1]] -= seconds
+
+    def finish(self) -> Tuple[float, Dict[str, float]]:
+        total = time.perf_counter() - self.started_at
+        phases = dict(self.seconds)
+        phases["other"] = max(0.0, total - sum(seconds for phase, seconds in phases.items() if phase != "other"))
+        return total, phases
+
+    def server_timing_header(self) -> bytes:
+        total, phases = self.finish()
+        entries = [f"{phase};dur={seconds * 1000:.2f}" for phase, seconds in phases.items() if seconds]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries).encode()
+
+
+current_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_request_timings",
+                                                                            default=None)
+
+
+@contextmanager
+def request_phase(phase: str):
+    timings = current_request_timings.get()
+    if timings is None:
+        yield
+        return
+    timings.enter(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.exit(phase, time.perf_counter() - start)
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    timings = current_request_timings.get()
+    if timings is not None:
+        timings.record(phase, seconds)
+
+
+def timed_phase(phase: str):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with request_phase(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedTemplate(jinja2.Template):
+    # set as template_class of the Jinja environment, so every page render counts as "template"
+    def render(self, *args, **kwargs) -> str:
+        with request_phase("template"):
+            return super().render(*args, **kwargs)
+
+
+class RequestTimingMiddleware:
+    # plain ASGI middleware like QueryStatsMiddleware, a streamed response is measured until its last chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_request_timings.set(timings)
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING_HEADER:
+                message = dict(message, headers=list(message.get("headers", [])) +
+                               [(b"server-timing", timings.server_timing_header())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            current_request_timings.reset(token)
+            method, route = scope["method"], route_template(scope)
+            total, phases = timings.finish()
+            request_duration_seconds.observe(method, route, value=total)
+            for phase, seconds in phases.items():
+                request_phase_seconds.observe(method, route, phase, value=seconds)
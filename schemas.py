@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional, Dict
 from datetime import datetime
 
 
@@ -47,6 +47,19 @@ class TeamDetailsMemberSchema(BaseModel):
     members: List[MemberSchema]
 
 
+class AvailabilityWindowSchema(BaseModel):
+    start: datetime
+    end: datetime
+    certain: int
+    possible: int
+
+
+class TeamAvailabilitySchema(BaseModel):
+    team_id: str
+    member_count: int
+    windows: List[AvailabilityWindowSchema]
+
+
 class TeamNameSchema(BaseModel):
     team_name: str
 
@@ -70,6 +83,8 @@ class EventSchema(BaseModel):
     start_point: datetime
     end_point: datetime
     event_priority: str
+    version: int = 1
+    recurrence: Optional[str] = None
 
 
 class MemberEventsSchema(BaseModel):
@@ -92,6 +107,8 @@ class PostTeamEventsSchema(BaseModel):
 class PostOrgCalendarSchema(BaseModel):
     memberEvents: PostMemberEventsSchema
     teamsEvents: List[PostTeamEventsSchema]
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
 
 
 class TeamEventsMembersSchema(BaseModel):
@@ -107,6 +124,42 @@ class OrgCalendarSchema(BaseModel):
     teams: List[TeamEventsMembersSchema]
 
 
+class EventChangeSchema(BaseModel):
+    title: str
+    memo: str
+    start_point: datetime
+    end_point: datetime
+    event_priority: str
+    recurrence: Optional[str] = None
+
+
+class CreatedEventSchema(EventChangeSchema):
+    client_id: str
+    team_id: Optional[str] = None
+
+
+class UpdatedEventSchema(EventChangeSchema):
+    id: str
+    version: int
+
+
+class DeletedEventSchema(BaseModel):
+    id: str
+    version: int
+
+
+class PostCalendarChangesSchema(BaseModel):
+    created: List[CreatedEventSchema] = []
+    updated: List[UpdatedEventSchema] = []
+    deleted: List[DeletedEventSchema] = []
+
+
+class CalendarChangesResultSchema(BaseModel):
+    created: Dict[str, str]
+    versions: Dict[str, int]
+    deleted: List[str]
+
+
 class ChangeTeamRoleSchema(BaseModel):
     user_id: str
     new_admin_state: bool
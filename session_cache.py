@@ -0,0 +1,22 @@
+import os
+from datetime import datetime
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+
+from ttl_cache import TTLCache
+
+load_dotenv()
+
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_REFRESH_THRESHOLD_MINUTES = float(os.environ.get("SESSION_REFRESH_THRESHOLD_MINUTES", "60"))
+
+
+class CachedSession(NamedTuple):
+    user_id: str
+    expiration_date: datetime
+
+
+# sessions by token, a logout handled by another worker is picked up after the ttl
+session_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SECONDS)
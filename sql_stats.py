@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter as StatementCounter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from db_session import engine, env_flag
+from metrics import Counter, Gauge, metrics_registry, route_template
+from request_timing import record_phase
+
+load_dotenv()
+
+# adds X-DB-* headers to every response, only meant for development
+SQL_DEBUG_HEADERS = env_flag("SQL_DEBUG_HEADERS", "false")
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", "100"))
+# a statement shape executed this often within one request is reported as a likely N+1 pattern
+SQL_REPEATED_STATEMENT_THRESHOLD = int(os.environ.get("SQL_REPEATED_STATEMENT_THRESHOLD", "5"))
+
+PARAMETER_PATTERN = re.compile(r"%\(\w+\)s|%s|\$\d+|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+logger = logging.getLogger(__name__)
+
+requests_total = metrics_registry.register(Counter(
+    "http_requests_total", "Handled requests.", ("method", "route", "status")))
+queries_total = metrics_registry.register(Counter(
+    "db_queries_total", "SQL statements executed while handling requests.", ("method", "route")))
+query_seconds_total = metrics_registry.register(Counter(
+    "db_query_seconds_total", "Time spent in SQL statements while handling requests.", ("method", "route")))
+slow_queries_total = metrics_registry.register(Counter(
+    "db_slow_queries_total", f"SQL statements slower than {SQL_SLOW_QUERY_MS:g}ms.", ("method", "route")))
+repeated_statement_requests_total = metrics_registry.register(Counter(
+    "db_repeated_statement_requests_total", "Requests that repeated one statement shape at least "
+                                            f"{SQL_REPEATED_STATEMENT_THRESHOLD} times.", ("method", "route")))
+slowest_query_seconds = metrics_registry.register(Gauge(
+    "db_slowest_query_seconds", "Slowest SQL statement seen since the start of the worker.", ("method", "route")))
+
+
+@lru_cache(maxsize=1000)
+def statement_shape(statement: str) -> str:
+    # parameters, literals and expanded IN lists are folded, so "WHERE id = ?" is one shape for every id
+    shape = PARAMETER_PATTERN.sub("?", " ".join(statement.split()))
+    return PARAMETER_LIST_PATTERN.sub("(?, ...)", shape)
+
+
+class RequestQueryStats:
+    # statements of one request run one after another, even when the handler hops between threads
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slow_count = 0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = ""
+        self.shapes = StatementCounter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        shape = statement_shape(statement)
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[shape] += 1
+        if seconds * 1000 >= SQL_SLOW_QUERY_MS:
+            self.slow_count += 1
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = shape
+
+    def repeated_statements(self) -> List[Tuple[str, int]]:
+        return [(shape, count) for shape, count in self.shapes.most_common()
+                if count >= SQL_REPEATED_STATEMENT_THRESHOLD]
+
+    def debug_headers(self) -> List[Tuple[bytes, bytes]]:
+        headers = {
+            "x-db-query-count": str(self.count),
+            "x-db-time-ms": f"{self.seconds * 1000:.2f}",
+            "x-db-slowest-ms": f"{self.slowest_seconds * 1000:.2f}",
+            "x-db-slowest-statement": self.slowest_statement[:200],
+            "x-db-repeated-statements": str(len(self.repeated_statements())),
+        }
+        return [(name.encode(), value.encode("latin-1", "replace")) for name, value in headers.items()]
+
+
+current_query_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("current_query_stats", default=None)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start_times"].pop()
+    record_phase("db", seconds)
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+
+@event.listens_for(engine, "handle_error")
+def discard_query_timer(context):
+    # a failed statement never reaches after_cursor_execute, its start time would be taken by the next statement
+    if context.connection is not None:
+        context.connection.info.pop("query_start_times", None)
+
+
+def record_request(method: str, route: str, status: int, stats: RequestQueryStats) -> None:
+    requests_total.inc(method, route, str(status))
+    queries_total.inc(method, route, amount=stats.count)
+    query_seconds_total.inc(method, route, amount=stats.seconds)
+    slow_queries_total.inc(method, route, amount=stats.slow_count)
+    repeated_statements = stats.repeated_statements()
+    if repeated_statements:
+        repeated_statement_requests_total.inc(method, route)
+    if stats.count:
+        slowest_query_seconds.set_max(method, route, value=stats.slowest_seconds)
+
+    record = {
+        "method": method,
+        "route": route,
+        "status": status,
+        "queries": stats.count,
+        "db_ms": round(stats.seconds * 1000, 2),
+        "slowest_ms": round(stats.slowest_seconds * 1000, 2),
+        "slowest_statement": stats.slowest_statement,
+        "repeated_statements": [{"statement": shape, "count": count} for shape, count in repeated_statements],
+    }
+    level = logging.WARNING if stats.slow_count or repeated_statements else logging.DEBUG
+    logger.log(level, json.dumps(record), extra={"sql_stats": record})
+
+
+class QueryStatsMiddleware:
+    # plain ASGI middleware, so streamed responses are passed through untouched
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = current_query_stats.set(stats)
+        status = 500
+
+        async def send_with_stats(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SQL_DEBUG_HEADERS:
+                    message = dict(message, headers=list(message.get("headers", [])) + stats.debug_headers())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_query_stats.reset(token)
+            record_request(scope["method"], route_template(scope), status, stats)
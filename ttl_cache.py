@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    # Least recently used entries are evicted beyond max_size. Entries are only trusted for ttl_seconds, so a change
+    # made by another worker is picked up after that time, a non-positive ttl_seconds disables the cache
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.__max_size = max_size
+        self.__ttl_seconds = ttl_seconds
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            value, cached_at = entry
+            if time.monotonic() - cached_at > self.__ttl_seconds:
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.__ttl_seconds <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (value, time.monotonic())
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def invalidate_where(self, matches: Callable[[Hashable], bool]) -> None:
+        with self.__lock:
+            for key in [key for key in self.__entries if matches(key)]:
+                del self.__entries[key]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
@@ -1,5 +1,13 @@
+import calendar
+import glob
+import hashlib
+import os
+import time
+import uuid
+from email.utils import format_datetime
+
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -12,6 +20,83 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def add_months(date, months):
+    # the day is clamped to the length of the target month
+    month_index = date.month - 1 + months
+    year, month = date.year + month_index // 12, month_index % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+
 def add_amount_of_days(date, days):
     new_date = date + timedelta(days=days)
     return new_date
+
+
+def to_naive_utc(date):
+    if date is None or date.tzinfo is None:
+        return date
+    return date.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def generate_id():
+    # UUIDv7 layout: 48 bit unix milliseconds first, so new rows are appended to the end of the primary key index
+    value = (int(time.time() * 1000) & ((1 << 48) - 1)) << 80
+    value |= int.from_bytes(os.urandom(10), "big") & ((1 << 80) - 1)
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return uuid.UUID(int=value).hex
+
+
+def generate_token():
+    # fully random, for ids that are handed out as secrets (sessions, invites, organization codes)
+    return uuid.uuid4().hex
+
+
+def to_iso_utc(date):
+    # ISO 8601 with a "Z" suffix, the format the calendar pages parse
+    return to_naive_utc(date).isoformat() + "Z"
+
+
+def to_epoch_seconds(date):
+    # naive datetimes from the database are UTC
+    return int(date.replace(tzinfo=timezone.utc).timestamp())
+
+
+def join_chunks(pieces, chunk_size):
+    # a streamed response sends one chunk per yielded value, small pieces are collected up to chunk_size characters
+    buffer, buffered = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def hash_files(patterns):
+    # content hash of the matching files in a fixed order, so every process computes the same value for the same files
+    digest = hashlib.sha1()
+    paths = {path for pattern in patterns for path in glob.glob(pattern, recursive=True) if os.path.isfile(path)}
+    for path in sorted(paths):
+        digest.update(path.encode())
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def compute_etag(content: bytes):
+    return '"' + hashlib.sha1(content).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+def to_http_date(date):
+    # naive datetimes from the database are UTC
+    return format_datetime(date.replace(tzinfo=timezone.utc), usegmt=True)